@@ -1,47 +1,70 @@
 import hmac
 import hashlib
 import time
-from urllib.parse import parse_qs
+from urllib.parse import unquote_plus
 from fastapi import HTTPException
-import json
+
+try:
+    import orjson as _json
+except ImportError:
+    import json as _json
+
+
+def _parse_init_data(init_data: str) -> dict:
+    """Разбор initData в dict[str, str]: все поля Telegram однозначные"""
+    parsed = {}
+    for pair in init_data.split('&'):
+        key, _, value = pair.partition('=')
+        if not value:
+            continue
+        key = unquote_plus(key)
+        if key not in parsed:
+            parsed[key] = unquote_plus(value)
+    return parsed
+
 
 class TelegramAuth:
     def __init__(self, bot_token: str):
         self.bot_token = bot_token
+        # Ключ зависит только от токена бота, считаем его один раз
+        self._secret_key = hmac.new(
+            b"WebAppData",
+            bot_token.encode(),
+            hashlib.sha256
+        ).digest() if bot_token else None
     
     def validate_init_data(self, init_data: str) -> dict:
         """Валидация Telegram WebApp initData"""
         try:
-            parsed = parse_qs(init_data)
-            hash_str = parsed.get('hash', [None])[0]
+            parsed = _parse_init_data(init_data)
+            hash_str = parsed.get('hash')
             
             if not hash_str:
                 raise ValueError("Missing hash")
             
-            data_check = []
-            for key in sorted(parsed.keys()):
-                if key != 'hash':
-                    data_check.append(f"{key}={parsed[key][0]}")
+            data_check = b"\n".join(
+                f"{key}={value}".encode()
+                for key, value in sorted(parsed.items())
+                if key != 'hash'
+            )
             
-            secret_key = hmac.new(
-                b"WebAppData",
-                self.bot_token.encode(),
-                hashlib.sha256
-            ).digest()
+            if self._secret_key is None:
+                raise ValueError("Bot token is not configured")
             
             calculated_hash = hmac.new(
-                secret_key,
-                '\n'.join(data_check).encode(),
+                self._secret_key,
+                data_check,
                 hashlib.sha256
             ).hexdigest()
             
-            if calculated_hash != hash_str:
+            # Сравнение за постоянное время, без утечки по таймингу
+            if not hmac.compare_digest(calculated_hash, hash_str):
                 raise ValueError("Invalid hash")
             
-            if time.time() - int(parsed['auth_date'][0]) > 86400:
+            if time.time() - int(parsed['auth_date']) > 86400:
                 raise ValueError("Data expired")
             
-            return json.loads(parsed['user'][0])
+            return _json.loads(parsed['user'])
             
         except Exception as e:
             raise HTTPException(status_code=401, detail=str(e))
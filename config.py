@@ -1,66 +1,97 @@
 import os
+from functools import lru_cache
 from dotenv import load_dotenv
 
-load_dotenv()
 
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///casino.db")
+@lru_cache(maxsize=None)
+def _load_env() -> dict:
+    """Чтение .env и снимок окружения - один раз на процесс"""
+    load_dotenv()
+    return dict(os.environ)
 
-DEV_MODE = os.getenv("DEV_MODE", "false").lower() == "true"
+
+env = _load_env()
+
+
+def _bool(name: str, default: bool) -> bool:
+    value = env.get(name)
+    return value.lower() == "true" if value is not None else default
+
+
+def _int(name: str, default: int) -> int:
+    value = env.get(name)
+    return int(value) if value else default
+
+
+def _float(name: str, default: float) -> float:
+    value = env.get(name)
+    return float(value) if value else default
+
+
+DATABASE_URL = env.get("DATABASE_URL", "sqlite+aiosqlite:///casino.db")
+
+DEV_MODE = _bool("DEV_MODE", False)
+# Баннер с настройками при старте - по умолчанию только в режиме разработки
+LOG_BANNER = _bool("LOG_BANNER", DEV_MODE)
 
 # CORS settings - для продакшена разрешаем GitHub Pages
-CORS_ORIGINS = [
-    "https://mtkache09.github.io",
-    "https://mtkache09.github.io/*",
-    "http://localhost:3000",  # Для локальной разработки фронтенда
-    "http://localhost:8080",
-    "http://127.0.0.1:3000",
-    "http://127.0.0.1:8080"
-]
+# Заголовок Origin не содержит пути, поэтому GitHub Pages матчится по хосту;
+# localhost и 127.0.0.1 - для локальной разработки фронтенда
+CORS_ORIGIN_REGEX = env.get(
+    "CORS_ORIGIN_REGEX",
+    r"^https://mtkache09\.github\.io$|^http://(localhost|127\.0\.0\.1):(3000|8080)$"
+)
 
-RABBITMQ_URL = os.getenv("RABBITMQ_URL")
+RABBITMQ_URL = env.get("RABBITMQ_URL")
 
-API_HOST = os.getenv("API_HOST", "0.0.0.0")
-API_PORT = int(os.getenv("PORT", os.getenv("API_PORT", "8000")))
+API_HOST = env.get("API_HOST", "0.0.0.0")
+API_PORT = _int("PORT", _int("API_PORT", 8000))
 
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-if BOT_TOKEN is not None:
-    BOT_TOKEN = str(BOT_TOKEN)
-WEB_APP_URL = os.getenv("WEB_APP_URL")
+BOT_TOKEN = env.get("BOT_TOKEN")
+WEB_APP_URL = env.get("WEB_APP_URL")
 
-TON_TESTNET = os.getenv("TON_TESTNET", "true").lower() == "true"
+TON_TESTNET = _bool("TON_TESTNET", True)
 
 # TON кошельки для получения платежей
-TON_WALLET_TESTNET = os.getenv("TON_WALLET_TESTNET", "EQD4FPq-PRDieyQKkizFTRtSDyucUIqrj0v_zXJmqaDp6_0t")
-TON_WALLET_MAINNET = os.getenv("TON_WALLET_MAINNET", "EQD4FPq-PRDieyQKkizFTRtSDyucUIqrj0v_zXJmqaDp6_0t")  # Замените на ваш основной адрес
+TON_WALLET_TESTNET = env.get("TON_WALLET_TESTNET", "EQD4FPq-PRDieyQKkizFTRtSDyucUIqrj0v_zXJmqaDp6_0t")
+TON_WALLET_MAINNET = env.get("TON_WALLET_MAINNET", "EQD4FPq-PRDieyQKkizFTRtSDyucUIqrj0v_zXJmqaDp6_0t")  # Замените на ваш основной адрес
 
 # Выбираем адрес в зависимости от сети
 TON_WALLET_ADDRESS = TON_WALLET_TESTNET if TON_TESTNET else TON_WALLET_MAINNET
 
 # Настройки для автоматического вывода TON
-WITHDRAWAL_ENABLED = os.getenv("WITHDRAWAL_ENABLED", "false").lower() == "true"
-WITHDRAWAL_MIN_AMOUNT = int(os.getenv("WITHDRAWAL_MIN_AMOUNT", "1000"))  # Минимальная сумма в фантиках
-WITHDRAWAL_MAX_AMOUNT = int(os.getenv("WITHDRAWAL_MAX_AMOUNT", "100000"))  # Максимальная сумма в фантиках
-WITHDRAWAL_DAILY_LIMIT = int(os.getenv("WITHDRAWAL_DAILY_LIMIT", "500000"))  # Дневной лимит в фантиках
-WITHDRAWAL_FEE_PERCENT = float(os.getenv("WITHDRAWAL_FEE_PERCENT", "2.0"))  # Комиссия в процентах
+WITHDRAWAL_ENABLED = _bool("WITHDRAWAL_ENABLED", False)
+WITHDRAWAL_MIN_AMOUNT = _int("WITHDRAWAL_MIN_AMOUNT", 1000)  # Минимальная сумма в фантиках
+WITHDRAWAL_MAX_AMOUNT = _int("WITHDRAWAL_MAX_AMOUNT", 100000)  # Максимальная сумма в фантиках
+WITHDRAWAL_DAILY_LIMIT = _int("WITHDRAWAL_DAILY_LIMIT", 500000)  # Дневной лимит в фантиках
+WITHDRAWAL_FEE_PERCENT = _float("WITHDRAWAL_FEE_PERCENT", 2.0)  # Комиссия в процентах
 
 # Приватный ключ для автоматического вывода (ОСТОРОЖНО!)
-WITHDRAWAL_PRIVATE_KEY = os.getenv("WITHDRAWAL_PRIVATE_KEY")  # Base64 encoded private key
+WITHDRAWAL_PRIVATE_KEY = env.get("WITHDRAWAL_PRIVATE_KEY")  # Base64 encoded private key
 
 # Админ ID для управления системой
-ADMIN_ID = os.getenv("ADMIN_ID", "1943755838")  # ID администратора Telegram
+ADMIN_ID = env.get("ADMIN_ID", "1943755838")  # ID администратора Telegram
 ADMIN_IDS = [int(ADMIN_ID)] if ADMIN_ID else [1943755838]  # Список админ ID
 
-print(f"🔧 Режим разработки: {DEV_MODE}")
-print(f"🌐 Web App URL: {WEB_APP_URL}")
-print(f"🔒 CORS Origins: {CORS_ORIGINS}")
-print(f"🗄️ Database: {'Neon' if 'neon' in str(DATABASE_URL) else 'PostgreSQL' if 'postgresql' in str(DATABASE_URL) else 'SQLite'}")
-print(f"🐰 RabbitMQ: {'CloudAMQP' if RABBITMQ_URL and 'cloudamqp' in RABBITMQ_URL else 'Local' if RABBITMQ_URL else 'Отключен'}")
-print(f"🌐 TON Network: {'TESTNET' if TON_TESTNET else 'MAINNET'}")
-print(f"💰 TON Wallet: {TON_WALLET_ADDRESS[:10]}...{TON_WALLET_ADDRESS[-10:]}")
-print(f"💸 Withdrawal: {'Enabled' if WITHDRAWAL_ENABLED else 'Disabled'}")
-if WITHDRAWAL_ENABLED:
-    print(f"📊 Withdrawal Limits: {WITHDRAWAL_MIN_AMOUNT:,} - {WITHDRAWAL_MAX_AMOUNT:,} fantics")
-    print(f"📅 Daily Limit: {WITHDRAWAL_DAILY_LIMIT:,} fantics")
-    print(f"💸 Fee: {WITHDRAWAL_FEE_PERCENT}%")
-
-print(f"👑 Admin ID: {ADMIN_ID}")
+# Короткое представление адреса для логов
+TON_WALLET_PREVIEW = f"{TON_WALLET_ADDRESS[:10]}...{TON_WALLET_ADDRESS[-10:]}"
+
+if LOG_BANNER:
+    _banner = [
+        f"🔧 Режим разработки: {DEV_MODE}",
+        f"🌐 Web App URL: {WEB_APP_URL}",
+        f"🔒 CORS Origin Regex: {CORS_ORIGIN_REGEX}",
+        f"🗄️ Database: {'Neon' if 'neon' in str(DATABASE_URL) else 'PostgreSQL' if 'postgresql' in str(DATABASE_URL) else 'SQLite'}",
+        f"🐰 RabbitMQ: {'CloudAMQP' if RABBITMQ_URL and 'cloudamqp' in RABBITMQ_URL else 'Local' if RABBITMQ_URL else 'Отключен'}",
+        f"🌐 TON Network: {'TESTNET' if TON_TESTNET else 'MAINNET'}",
+        f"💰 TON Wallet: {TON_WALLET_PREVIEW}",
+        f"💸 Withdrawal: {'Enabled' if WITHDRAWAL_ENABLED else 'Disabled'}",
+    ]
+    if WITHDRAWAL_ENABLED:
+        _banner += [
+            f"📊 Withdrawal Limits: {WITHDRAWAL_MIN_AMOUNT:,} - {WITHDRAWAL_MAX_AMOUNT:,} fantics",
+            f"📅 Daily Limit: {WITHDRAWAL_DAILY_LIMIT:,} fantics",
+            f"💸 Fee: {WITHDRAWAL_FEE_PERCENT}%",
+        ]
+    _banner.append(f"👑 Admin ID: {ADMIN_ID}")
+    print("\n".join(_banner))
@@ -1,5 +1,6 @@
+import asyncio
 from .models import Base, User, TonWallet, Case, Present, CasePresent, PendingPayment, SuccessfulPayment, WithdrawalRequest
-from .manager import DatabaseManager
+from .manager import DatabaseManager, start_statement_count
 from .users import UserManager
 from .wallets import WalletManager
 from .payments import PaymentManager
@@ -12,10 +13,14 @@ class DatabaseFacade:
     """
     Фасадный класс для обеспечения совместимости с существующим кодом.
     Объединяет все модули в единый интерфейс.
+    
+    Соглашение для методов менеджеров: связи ORM-объектов загружаются только явно
+    (selectinload/joinedload), а в DEV_MODE к запросам добавляется raiseload("*"),
+    чтобы случайная ленивая загрузка падала сразу, а не превращалась в N+1.
     """
     
-    def __init__(self, database_url: str):
-        self.db_manager = DatabaseManager(database_url)
+    def __init__(self, database_url: str, dev_mode: bool = False):
+        self.db_manager = DatabaseManager(database_url, dev_mode)
         self.user_manager = UserManager(self.db_manager)
         self.wallet_manager = WalletManager(self.db_manager)
         self.payment_manager = PaymentManager(self.db_manager)
@@ -33,28 +38,59 @@ class DatabaseFacade:
     
     async def close(self):
         """Закрытие соединения"""
+        await self.user_manager.stop_username_writer()
+        await self.case_manager.close()
         await self.db_manager.close()
     
-    async def clear_cache_and_reconnect(self):
-        """Очистка кэша и переподключение"""
-        await self.db_manager.clear_cache_and_reconnect()
-    
     # Делегирование методов пользователей
     async def add_user(self, user_id: int, username: Optional[str] = None) -> bool:
         return await self.user_manager.add_user(user_id, username)
     
-    async def get_user(self, user_id: int):
-        return await self.user_manager.get_user(user_id)
+    async def add_users_batch(self, rows) -> int:
+        return await self.user_manager.add_users_batch(rows)
+    
+    async def get_user(self, user_id: int, session=None):
+        return await self.user_manager.get_user(user_id, session)
+    
+    async def get_user_row(self, user_id: int, session=None):
+        return await self.user_manager.get_user_row(user_id, session)
+    
+    async def get_user_with_wallets(self, user_id: int, session=None):
+        return await self.user_manager.get_user_with_wallets(user_id, session)
+    
+    async def get_users(self, user_ids):
+        return await self.user_manager.get_users(user_ids)
+    
+    async def get_all_users(self, options=None):
+        return await self.user_manager.get_all_users(options)
+    
+    async def get_all_user_rows(self):
+        return await self.user_manager.get_all_user_rows()
+    
+    async def get_user_bundle(self, user_id: int):
+        """
+        Пользователь и его активные кошельки параллельно, на двух соединениях пула:
+        (строка пользователя или None, список строк кошельков).
+        Оба чтения идут мимо сессии, поэтому безопасны для gather и внутри запроса
+        """
+        user, wallets = await asyncio.gather(
+            self.user_manager.get_user_row(user_id),
+            self.wallet_manager.get_user_ton_wallet_rows(user_id)
+        )
+        return user, wallets
     
-    async def get_all_users(self):
-        return await self.user_manager.get_all_users()
+    def iter_users(self, options=None, batch_size: int = 1000):
+        return self.user_manager.iter_users(options, batch_size)
     
-    async def get_users_count(self) -> int:
-        return await self.user_manager.get_users_count()
+    async def get_users_count(self, session=None, exact: bool = False) -> int:
+        return await self.user_manager.get_users_count(session, exact)
     
     # Делегирование методов фантиков
-    async def get_fantics(self, user_id: int):
-        return await self.user_manager.get_fantics(user_id)
+    async def get_fantics(self, user_id: int, session=None):
+        return await self.user_manager.get_fantics(user_id, session)
+    
+    async def get_fantics_many(self, user_ids):
+        return await self.user_manager.get_fantics_many(user_ids)
     
     async def add_fantics(self, user_id: int, amount: int) -> bool:
         return await self.user_manager.add_fantics(user_id, amount)
@@ -76,14 +112,26 @@ class DatabaseFacade:
         return await self.user_manager.atomic_add_fantics(user_id, amount)
     
     # Делегирование методов кошельков
-    async def add_ton_wallet(self, user_id: int, wallet_address: str, network=None, public_key=None, retry_count=0):
-        return await self.wallet_manager.add_ton_wallet(user_id, wallet_address, network, public_key, retry_count)
+    async def add_ton_wallet(self, user_id: int, wallet_address: str, network=None, public_key=None):
+        return await self.wallet_manager.add_ton_wallet(user_id, wallet_address, network, public_key)
+    
+    async def add_ton_wallets_batch(self, rows) -> int:
+        return await self.wallet_manager.add_ton_wallets_batch(rows)
+    
+    async def get_user_ton_wallet_rows(self, user_id: int):
+        return await self.wallet_manager.get_user_ton_wallet_rows(user_id)
+    
+    async def get_user_active_wallet_addresses(self, user_id: int):
+        return await self.wallet_manager.get_user_active_wallet_addresses(user_id)
     
     async def get_user_ton_wallets(self, user_id: int):
         return await self.wallet_manager.get_user_ton_wallets(user_id)
     
-    async def get_ton_wallet_by_address(self, wallet_address: str, retry_count=0):
-        return await self.wallet_manager.get_ton_wallet_by_address(wallet_address, retry_count)
+    async def get_ton_wallet_by_address(self, wallet_address: str):
+        return await self.wallet_manager.get_ton_wallet_by_address(wallet_address)
+    
+    async def set_wallet_active(self, wallet_address: str, active: bool) -> bool:
+        return await self.wallet_manager.set_wallet_active(wallet_address, active)
     
     async def deactivate_ton_wallet(self, wallet_address: str) -> bool:
         return await self.wallet_manager.deactivate_ton_wallet(wallet_address)
@@ -106,8 +154,11 @@ class DatabaseFacade:
             destination_address, comment, expires_in_minutes
         )
     
-    async def get_pending_payment(self, payment_id: str):
-        return await self.payment_manager.get_pending_payment(payment_id)
+    async def create_pending_payments_bulk(self, payments: list):
+        return await self.payment_manager.create_pending_payments_bulk(payments)
+    
+    async def get_pending_payment(self, payment_id: str, session=None):
+        return await self.payment_manager.get_pending_payment(payment_id, session)
     
     async def update_payment_status(self, payment_id: str, status: str, transaction_hash=None):
         return await self.payment_manager.update_payment_status(payment_id, status, transaction_hash)
@@ -118,6 +169,45 @@ class DatabaseFacade:
             user_id, payment_method, amount_fantics, amount_paid, sender_wallet, transaction_hash, payment_id
         )
     
+    async def expire_payment_if_due(self, payment_id: str) -> bool:
+        return await self.payment_manager.expire_payment_if_due(payment_id)
+    
+    async def expire_old_payments(self):
+        return await self.payment_manager.expire_old_payments()
+    
+    def start_payment_expiry_sweep(self):
+        self.payment_manager.start_expiry_sweep()
+    
+    async def stop_payment_expiry_sweep(self):
+        await self.payment_manager.stop_expiry_sweep()
+    
+    async def confirm_payment(self, payment_id: str, user_id: int, payment_method: str, amount_fantics: int,
+                              amount_paid: float, sender_wallet=None, transaction_hash=None):
+        """
+        Подтверждение платежа одной транзакцией: начисление фантиков, запись успешного платежа
+        и статус 'confirmed' либо применяются вместе, либо не применяются вовсе
+        Возвращает: (успех, сообщение, новый_баланс)
+        """
+        try:
+            async with self.db_manager.unit_of_work() as session:
+                success, message, new_balance = await self.user_manager.atomic_add_fantics(
+                    user_id, amount_fantics, session
+                )
+                if not success:
+                    return success, message, new_balance
+                if not await self.payment_manager.add_successful_payment(
+                    user_id, payment_method, amount_fantics, amount_paid,
+                    sender_wallet, transaction_hash, payment_id, session=session
+                ):
+                    raise RuntimeError("не удалось записать успешный платеж")
+                if not await self.payment_manager.update_payment_status(
+                    payment_id, 'confirmed', transaction_hash, session=session
+                ):
+                    raise RuntimeError("не удалось обновить статус платежа")
+                return success, message, new_balance
+        except Exception as e:
+            return False, f"Ошибка подтверждения платежа: {e}", 0
+    
     # Делегирование методов выводов
     async def create_withdrawal_request(self, user_id: int, amount_fantics: int, amount_ton: float,
                                       fee_amount: float, destination_address: str):
@@ -134,6 +224,9 @@ class DatabaseFacade:
     async def update_withdrawal_status(self, request_id: int, status: str, transaction_hash=None, error_message=None):
         return await self.withdrawal_manager.update_withdrawal_status(request_id, status, transaction_hash, error_message)
     
+    async def get_user_withdrawn_today(self, user_id: int) -> int:
+        return await self.withdrawal_manager.get_user_withdrawn_today(user_id)
+    
     async def get_withdrawal_statistics(self):
         return await self.withdrawal_manager.get_withdrawal_statistics()
 
@@ -150,6 +243,7 @@ __all__ = [
     'WithdrawalRequest',
     
     'DatabaseManager',
+    'start_statement_count',
     'UserManager',
     'WalletManager', 
     'PaymentManager',
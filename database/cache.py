@@ -0,0 +1,74 @@
+"""
+In-process TTL cache for hot per-user reads
+
+This module provides TTLCache class for:
+- Short-lived caching of values keyed by user_id
+- Write-through updates and invalidation from write paths
+- Protection against stale fills racing with concurrent writes
+"""
+
+import time
+from typing import Any, Dict, Hashable, Tuple
+
+
+class TTLCache:
+    """
+    Кэш с временем жизни записей и ограничением размера.
+    Читатель берет token() до запроса в БД и заполняет кэш через fill(): если за время
+    запроса была запись (set/pop/clear), устаревшее значение в кэш не попадет
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: Dict[Hashable, Tuple[float, Any]] = {}
+        self._version = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Значение из кэша или default, если записи нет или она истекла"""
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self._data.pop(key, None)
+            return default
+        return value
+
+    def token(self) -> int:
+        """Версия кэша на момент начала чтения из БД"""
+        return self._version
+
+    def fill(self, key: Hashable, value: Any, token: int):
+        """Заполнение кэша результатом чтения, если с момента token() не было записей"""
+        if token == self._version:
+            self._store(key, value)
+
+    def set(self, key: Hashable, value: Any):
+        """Запись нового значения со стороны пишущего кода (write-through)"""
+        self._version += 1
+        self._store(key, value)
+
+    def pop(self, key: Hashable):
+        """Инвалидация одного ключа"""
+        self._version += 1
+        self._data.pop(key, None)
+
+    def clear(self):
+        """Инвалидация всего кэша"""
+        self._version += 1
+        self._data.clear()
+
+    def _store(self, key: Hashable, value: Any):
+        if key not in self._data and len(self._data) >= self.maxsize:
+            self._evict()
+        self._data[key] = (time.monotonic() + self.ttl, value)
+
+    def _evict(self):
+        """Удаление истекших записей, а если их нет - самой старой"""
+        now = time.monotonic()
+        expired = [key for key, (expires_at, _) in self._data.items() if expires_at < now]
+        for key in expired:
+            del self._data[key]
+        if not expired:
+            del self._data[next(iter(self._data))]
@@ -8,16 +8,72 @@ This module provides CaseManager class for:
 - Initial data seeding
 """
 
+import asyncio
+import json
+import logging
 import random
+from itertools import accumulate
 from datetime import datetime
-from typing import List, Tuple, Dict, Optional
-from dataclasses import dataclass
-from sqlalchemy import select, func
-from sqlalchemy.orm import selectinload
+from typing import List, Tuple, Dict, Mapping, Optional
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from uuid import uuid4
+from sqlalchemy import select, delete, exists, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, raiseload, selectinload
 from .models import Case, Present, CasePresent
 from .manager import DatabaseManager
 
 
+logger = logging.getLogger(__name__)
+
+_random = random.random
+
+# Канал PostgreSQL LISTEN/NOTIFY: другие процессы перечитывают измененный кейс в свой кэш
+CASES_CHANNEL = "cases_changed"
+# Максимальная пауза между попытками восстановить разорванную подписку, секунды
+LISTENER_RECONNECT_MAX_DELAY = 30
+
+# Вероятности хранятся в процентах с точностью до 0.01%,
+# внутри работаем с целыми базисными пунктами: 100% == 10000
+_BASIS_POINTS = 10000
+
+
+def _to_basis_points(probability: float) -> int:
+    """Перевод вероятности в процентах в базисные пункты"""
+    return round(probability * 100)
+
+
+def _build_alias_table(weights: List[int]) -> Tuple[List[float], List[int]]:
+    """Построение alias-таблицы Воуза для выборки за O(1) в целых числах"""
+    n = len(weights)
+    total = sum(weights)
+    # Ячейка заполнена, когда её вес равен total (вместо 1.0 во float-версии)
+    scaled = [w * n for w in weights]
+    prob = [1.0] * n
+    alias = list(range(n))
+    
+    small = [i for i, q in enumerate(scaled) if q < total]
+    large = [i for i, q in enumerate(scaled) if q >= total]
+    
+    while small and large:
+        s = small.pop()
+        l = large.pop()
+        prob[s] = scaled[s] / total
+        alias[s] = l
+        scaled[l] -= total - scaled[s]
+        if scaled[l] < total:
+            small.append(l)
+        else:
+            large.append(l)
+    
+    # В точной арифметике остаются только полные ячейки
+    for i in small + large:
+        prob[i] = 1.0
+    
+    return prob, alias
+
+
 @dataclass
 class PresentData:
     id: Optional[int]
@@ -32,22 +88,69 @@ class CaseData:
     presents_with_probabilities: List[Tuple[PresentData, float]]
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
+    _presents: List[PresentData] = field(init=False, repr=False, compare=False)
+    _cum: List[int] = field(init=False, repr=False, compare=False)
+    _prob: List[float] = field(init=False, repr=False, compare=False)
+    _alias: List[int] = field(init=False, repr=False, compare=False)
     
     def __post_init__(self):
-        total_prob = sum(prob for _, prob in self.presents_with_probabilities)
-        if not (99.99 <= total_prob <= 100.01):
-            raise ValueError(f"Сумма вероятностей для кейса '{self.name}' должна быть 100%, а не {total_prob}%")
+        weights = [_to_basis_points(prob) for _, prob in self.presents_with_probabilities]
+        self._cum = list(accumulate(weights))
+        # Ровно 100% требует только validate_presents_list для нового ввода: alias-таблица и
+        # cum_weights нормируют по фактической сумме, поэтому сохраненные ранее кейсы
+        # с суммой 99.99% (например, 33.33 x 3) продолжают открываться
+        if not self._cum or self._cum[-1] <= 0:
+            raise ValueError(f"У кейса '{self.name}' нет подарков с ненулевой вероятностью")
+        
+        self._presents = [present for present, _ in self.presents_with_probabilities]
+        self._prob, self._alias = _build_alias_table(weights)
     
     def get_random_present(self) -> PresentData:
-        rand = random.uniform(0, 100)
-        cumulative_prob = 0
-        
-        for present, prob in self.presents_with_probabilities:
-            cumulative_prob += prob
-            if rand <= cumulative_prob:
-                return present
-        
-        return self.presents_with_probabilities[-1][0]
+        """Выбор подарка за O(1) по alias-таблице (метод Воуза)"""
+        # Одно случайное число: целая часть - ячейка, дробная - порог
+        u = _random() * len(self._presents)
+        i = int(u)
+        if u - i < self._prob[i]:
+            return self._presents[i]
+        return self._presents[self._alias[i]]
+    
+    def get_random_presents(self, count: int) -> List[PresentData]:
+        """Выбор нескольких подарков за один вызов (для массового открытия)"""
+        return random.choices(self._presents, cum_weights=self._cum, k=count)
+    
+    def to_dict(self) -> dict:
+        """Представление кейса для API"""
+        return {
+            "id": self.id,
+            "name": self.name,
+            "cost": self.cost,
+            "presents": [{"cost": p.cost, "probability": prob}
+                         for p, prob in self.presents_with_probabilities],
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
+# Начальные кейсы: (название, стоимость, ((стоимость подарка, вероятность), ...))
+_INITIAL_CASES: Tuple[Tuple[str, int, Tuple[Tuple[int, float], ...]], ...] = (
+    ("Стартовый кейс", 1000, (
+        (100, 30.0),
+        (200, 50.0),
+        (500, 20.0),
+    )),
+    ("Премиум кейс", 2500, (
+        (500, 40.0),
+        (1000, 35.0),
+        (2000, 20.0),
+        (5000, 5.0),
+    )),
+    ("VIP кейс", 10000, (
+        (2000, 30.0),
+        (5000, 40.0),
+        (10000, 25.0),
+        (50000, 5.0),
+    )),
+)
 
 
 class CaseRepository:
@@ -55,96 +158,236 @@ class CaseRepository:
     
     def __init__(self, db_manager: DatabaseManager):
         self.db = db_manager
+        # Кэш кейсов в памяти процесса: открытие кейса не ходит в БД
+        self._cache: Dict[int, CaseData] = {}
+        self._cache_view = MappingProxyType(self._cache)
+        self._cache_ready = False
+        self._write_lock = asyncio.Lock()
+        # Версия данных кейсов, увеличивается при каждом изменении
+        self.version = 0
+        self._all_cases_json: Optional[bytes] = None
+        # В DEV_MODE любая связь, не загруженная явно, падает с ошибкой вместо скрытого N+1
+        self._load_guard = [raiseload("*")] if db_manager.dev_mode else []
+        # Межпроцессная инвалидация кэша (только PostgreSQL, подписка через asyncpg)
+        self._notify = db_manager.engine.dialect.name == "postgresql"
+        self._instance_id = uuid4().hex
+        self._listener_conn = None
+        self._refresh_tasks = set()
+    
+    def _bump_version(self):
+        """Отметка об изменении кейсов и сброс готового JSON"""
+        self.version += 1
+        self._all_cases_json = None
     
     async def init_tables(self):
         """Инициализация таблиц и начальных данных"""
         await self._seed_initial_data()
+        await self._warm_cache()
     
-    async def _seed_initial_data(self):
-        """Заполнение начальными данными"""
-        count = await self.get_cases_count()
-        if count > 0:
-            return
-        
-        initial_cases = [
-            {
-                "name": "Стартовый кейс",
-                "cost": 1000,
-                "presents": [
-                    (100, 30.0),
-                    (200, 50.0),
-                    (500, 20.0),
-                ]
-            },
-            {
-                "name": "Премиум кейс",
-                "cost": 2500,
-                "presents": [
-                    (500, 40.0),
-                    (1000, 35.0),
-                    (2000, 20.0),
-                    (5000, 5.0),
-                ]
-            },
-            {
-                "name": "VIP кейс",
-                "cost": 10000,
-                "presents": [
-                    (2000, 30.0),
-                    (5000, 40.0),
-                    (10000, 25.0),
-                    (50000, 5.0),
-                ]
-            },
+    def _to_case_data(self, case: Case) -> CaseData:
+        """Преобразование ORM-модели кейса в CaseData"""
+        presents_data = [
+            (PresentData(id=cp.present.id, cost=cp.present.cost), cp.probability)
+            for cp in case.case_presents
         ]
         
-        for case_data in initial_cases:
-            await self.create_case(
-                name=case_data["name"],
-                cost=case_data["cost"],
-                presents_with_costs_and_probs=case_data["presents"]
+        return CaseData(
+            id=case.id,
+            name=case.name,
+            cost=case.cost,
+            presents_with_probabilities=presents_data,
+            created_at=case.created_at,
+            updated_at=case.updated_at
+        )
+    
+    async def _load_cases(self, session, case_id: Optional[int] = None) -> Dict[int, CaseData]:
+        """
+        Загрузка кейсов вместе с подарками: кейсы одним запросом, связи с подарками - вторым
+        (SELECT ... WHERE case_id IN (...)), без размножения строк кейса JOIN-ом по коллекции
+        """
+        stmt = select(Case).options(
+            selectinload(Case.case_presents).joinedload(CasePresent.present),
+            *self._load_guard
+        )
+        if case_id is not None:
+            stmt = stmt.where(Case.id == case_id)
+        
+        result = await session.execute(stmt)
+        loaded = {}
+        for case in result.scalars().all():
+            try:
+                loaded[case.id] = self._to_case_data(case)
+            except ValueError as e:
+                # Один испорченный кейс не должен ронять запуск и обновление кэша
+                logger.warning("⚠️ Кейс %s пропущен: %s", case.id, e)
+        return loaded
+    
+    async def _warm_cache(self):
+        """Заполнение кэша кейсов из базы данных"""
+        async with self.db.async_session() as session:
+            loaded = await self._load_cases(session)
+        self._cache.clear()
+        self._cache.update(loaded)
+        self._cache_ready = True
+        self._bump_version()
+    
+    async def _refresh_cached_case(self, case_id: int):
+        """Перечитывание одного кейса в кэш после изменения"""
+        async with self.db.async_session() as session:
+            loaded = await self._load_cases(session, case_id)
+        
+        if case_id in loaded:
+            self._cache[case_id] = loaded[case_id]
+        else:
+            self._cache.pop(case_id, None)
+        self._bump_version()
+    
+    async def _notify_changed(self, session, case_id: int):
+        """NOTIFY в той же транзакции: другие процессы получат его только после COMMIT"""
+        if self._notify:
+            await session.execute(select(func.pg_notify(CASES_CHANNEL, f"{self._instance_id}:{case_id}")))
+    
+    def _spawn(self, coro):
+        """Фоновая задача подписки: ссылка хранится до завершения, отменяется в stop_listening"""
+        task = asyncio.create_task(coro)
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._refresh_tasks.discard)
+    
+    def _on_cases_changed(self, conn, pid, channel, payload: str):
+        """Обработчик NOTIFY: перечитать измененный другим процессом кейс"""
+        source, _, case_id = payload.partition(":")
+        if source == self._instance_id or not self._cache_ready:
+            return
+        self._spawn(self._refresh_notified_case(int(case_id)))
+    
+    async def _refresh_notified_case(self, case_id: int):
+        """
+        Перечитывание кейса по NOTIFY. Под _write_lock: перечитывания идут по очереди,
+        и более раннее чтение не может перезаписать в кэше более позднее
+        """
+        try:
+            async with self._write_lock:
+                await self._refresh_cached_case(case_id)
+        except Exception as e:
+            logger.exception("❌ Ошибка обновления кейса %s по уведомлению: %s", case_id, e)
+    
+    def _on_listener_terminated(self, conn):
+        """Соединение подписки закрылось: переподключаемся, если это не stop_listening"""
+        if conn is not self._listener_conn:
+            return
+        self._listener_conn = None
+        logger.warning("⚠️ Соединение подписки на изменения кейсов разорвано, переподключение")
+        self._spawn(self._reconnect_listener())
+    
+    async def _reconnect_listener(self):
+        """Переподключение подписки с нарастающей паузой и полное перечитывание кэша"""
+        delay = 1
+        while self._listener_conn is None:
+            try:
+                await self.start_listening()
+                # Уведомления, пришедшие за время разрыва, потеряны
+                async with self._write_lock:
+                    await self._warm_cache()
+                logger.info("✅ Подписка на изменения кейсов восстановлена")
+                return
+            except Exception as e:
+                logger.warning("⚠️ Не удалось восстановить подписку на кейсы (повтор через %s с): %s", delay, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, LISTENER_RECONNECT_MAX_DELAY)
+    
+    async def start_listening(self):
+        """Подписка на изменения кейсов из других процессов"""
+        if not self._notify or self._listener_conn is not None:
+            return
+        conn = await self.db.connect_listener()
+        if conn is None:
+            return
+        try:
+            await conn.add_listener(CASES_CHANNEL, self._on_cases_changed)
+        except Exception:
+            await conn.close()
+            raise
+        self._listener_conn = conn
+        conn.add_termination_listener(self._on_listener_terminated)
+    
+    async def stop_listening(self):
+        """Отписка от изменений и закрытие соединения подписки"""
+        for task in list(self._refresh_tasks):
+            task.cancel()
+        conn, self._listener_conn = self._listener_conn, None
+        if conn is None:
+            return
+        conn.remove_termination_listener(self._on_listener_terminated)
+        await conn.remove_listener(CASES_CHANNEL, self._on_cases_changed)
+        await conn.close()
+    
+    async def _seed_initial_data(self):
+        """Заполнение начальными данными"""
+        async with self._write_lock, self.db.async_session() as session:
+            count = await self.get_cases_count(session)
+            if count > 0:
+                return
+            
+            # Одна транзакция: подарки, кейсы и связи вставляются пачками
+            presents = await self._get_or_create_presents(
+                session, [present_cost for _, _, items in _INITIAL_CASES for present_cost, _ in items]
             )
+            cases = [Case(name=name, cost=cost) for name, cost, _ in _INITIAL_CASES]
+            session.add_all(cases)
+            await session.flush()  # Получаем ID кейсов
+            
+            session.add_all([
+                CasePresent(case_id=case.id, present_id=presents[present_cost].id, probability=prob)
+                for case, (_, _, items) in zip(cases, _INITIAL_CASES)
+                for present_cost, prob in items
+            ])
+            await session.commit()
         
-        print("✅ Начальные кейсы созданы")
+        logger.info("✅ Начальные кейсы созданы")
     
-    async def _get_or_create_present(self, session, cost: int) -> Present:
-        """Получить или создать подарок"""
-        stmt = select(Present).where(Present.cost == cost)
+    async def _get_or_create_presents(self, session, costs: List[int]) -> Dict[int, Present]:
+        """Получить или создать подарки по списку стоимостей за один SELECT"""
+        unique_costs = set(costs)
+        stmt = select(Present).where(Present.cost.in_(unique_costs))
         result = await session.execute(stmt)
-        present = result.scalar_one_or_none()
+        presents = {present.cost: present for present in result.scalars().all()}
         
-        if not present:
-            present = Present(cost=cost)
-            session.add(present)
+        missing = [Present(cost=cost) for cost in unique_costs if cost not in presents]
+        if missing:
+            session.add_all(missing)
             await session.flush()  # Получаем ID
+            presents.update((present.cost, present) for present in missing)
         
-        return present
+        return presents
     
     async def create_case(self, name: str, cost: int, 
                          presents_with_costs_and_probs: List[Tuple[int, float]]) -> CaseData:
         """Создание нового кейса с подарками"""
         try:
-            async with self.db.async_session() as session:
+            async with self._write_lock, self.db.async_session() as session:
                 # Создаем кейс
                 case = Case(name=name, cost=cost)
                 session.add(case)
                 await session.flush()  # Получаем ID кейса
                 
+                presents = await self._get_or_create_presents(
+                    session, [cost for cost, _ in presents_with_costs_and_probs]
+                )
+                
                 # Создаем связи с подарками и собираем данные для ответа
-                presents_data = []
-                for cost, prob in presents_with_costs_and_probs:
-                    present = await self._get_or_create_present(session, cost)
-                    case_present = CasePresent(
-                        case_id=case.id,
-                        present_id=present.id,
-                        probability=prob
-                    )
-                    session.add(case_present)
-                    presents_data.append((PresentData(id=present.id, cost=present.cost), prob))
+                session.add_all([
+                    CasePresent(case_id=case.id, present_id=presents[cost].id, probability=prob)
+                    for cost, prob in presents_with_costs_and_probs
+                ])
+                presents_data = [
+                    (PresentData(id=presents[cost].id, cost=cost), prob)
+                    for cost, prob in presents_with_costs_and_probs
+                ]
                 
+                await self._notify_changed(session, case.id)
                 await session.commit()
                 
-                return CaseData(
+                case_data = CaseData(
                     id=case.id,
                     name=case.name,
                     cost=case.cost,
@@ -152,72 +395,62 @@ class CaseRepository:
                     created_at=case.created_at,
                     updated_at=case.updated_at
                 )
+                if self._cache_ready:
+                    self._cache[case.id] = case_data
+                self._bump_version()
+                
+                return case_data
                 
         except Exception as e:
-            print(f"❌ Ошибка создания кейса: {e}")
+            logger.exception("❌ Ошибка создания кейса: %s", e)
             raise
     
     async def get_case(self, case_id: int) -> Optional[CaseData]:
-        """Получение кейса по ID"""
-        try:
-            async with self.db.async_session() as session:
-                stmt = select(Case).where(Case.id == case_id)
-                result = await session.execute(stmt)
-                case = result.scalar_one_or_none()
-                
-                if not case:
-                    return None
-                
-                # Получаем подарки с вероятностями
-                stmt = select(CasePresent, Present).join(Present).where(CasePresent.case_id == case_id)
-                result = await session.execute(stmt)
-                case_presents = result.all()
-                
-                presents_data = [
-                    (PresentData(id=cp.present.id, cost=cp.present.cost), cp.probability)
-                    for cp, _ in case_presents
-                ]
-                
-                return CaseData(
-                    id=case.id,
-                    name=case.name,
-                    cost=case.cost,
-                    presents_with_probabilities=presents_data,
-                    created_at=case.created_at,
-                    updated_at=case.updated_at
-                )
-                
-        except Exception as e:
-            print(f"❌ Ошибка получения кейса: {e}")
-            return None
+        """Получение кейса по ID из кэша"""
+        if not self._cache_ready:
+            try:
+                await self._warm_cache()
+            except Exception as e:
+                logger.exception("❌ Ошибка получения кейса: %s", e)
+                return None
+        
+        return self._cache.get(case_id)
     
-    async def get_all_cases(self) -> Dict[int, CaseData]:
-        """Получение всех кейсов"""
-        try:
-            async with self.db.async_session() as session:
-                stmt = select(Case)
-                result = await session.execute(stmt)
-                cases = result.scalars().all()
-                
-                cases_dict = {}
-                for case in cases:
-                    case_data = await self.get_case(case.id)
-                    if case_data:
-                        cases_dict[case.id] = case_data
-                
-                return cases_dict
-                
-        except Exception as e:
-            print(f"❌ Ошибка получения всех кейсов: {e}")
-            return {}
+    async def get_all_cases(self) -> Mapping[int, CaseData]:
+        """Получение всех кейсов из кэша (только для чтения, без копирования)"""
+        if not self._cache_ready:
+            try:
+                await self._warm_cache()
+            except Exception as e:
+                logger.exception("❌ Ошибка получения всех кейсов: %s", e)
+                return MappingProxyType({})
+        
+        return self._cache_view
+    
+    async def get_all_cases_json(self) -> bytes:
+        """Получение всех кейсов в виде готового JSON-ответа для API"""
+        if self._all_cases_json is not None:
+            return self._all_cases_json
+        
+        cases = await self.get_all_cases()
+        payload = json.dumps(
+            [case.to_dict() for case in cases.values()],
+            ensure_ascii=False,
+            separators=(",", ":")
+        ).encode("utf-8")
+        
+        # Не кэшируем ответ, если загрузка кейсов завершилась ошибкой
+        if self._cache_ready:
+            self._all_cases_json = payload
+        return payload
     
     async def update_case(self, case_id: int, name: Optional[str] = None, 
                          cost: Optional[int] = None, 
                          presents_with_costs_and_probs: Optional[List[Tuple[int, float]]] = None) -> bool:
         """Обновление кейса"""
         try:
-            async with self.db.async_session() as session:
-                stmt = select(Case).where(Case.id == case_id)
+            async with self._write_lock, self.db.async_session() as session:
+                stmt = select(Case).where(Case.id == case_id).options(*self._load_guard)
                 result = await session.execute(stmt)
                 case = result.scalar_one_or_none()
                 
@@ -232,36 +465,35 @@ class CaseRepository:
                 
                 # Обновляем подарки если переданы
                 if presents_with_costs_and_probs is not None:
-                    # Удаляем старые связи
-                    stmt = select(CasePresent).where(CasePresent.case_id == case_id)
-                    result = await session.execute(stmt)
-                    old_case_presents = result.scalars().all()
-                    
-                    for old_cp in old_case_presents:
-                        await session.delete(old_cp)
+                    # Удаляем старые связи одним DELETE, без загрузки их в сессию
+                    await session.execute(delete(CasePresent).where(CasePresent.case_id == case_id))
                     
                     # Создаем новые связи
-                    for cost, prob in presents_with_costs_and_probs:
-                        present = await self._get_or_create_present(session, cost)
-                        case_present = CasePresent(
-                            case_id=case.id,
-                            present_id=present.id,
-                            probability=prob
-                        )
-                        session.add(case_present)
+                    presents = await self._get_or_create_presents(
+                        session, [cost for cost, _ in presents_with_costs_and_probs]
+                    )
+                    session.add_all([
+                        CasePresent(case_id=case.id, present_id=presents[cost].id, probability=prob)
+                        for cost, prob in presents_with_costs_and_probs
+                    ])
                 
+                await self._notify_changed(session, case_id)
                 await session.commit()
+                await self._refresh_cached_case(case_id)
                 return True
                 
         except Exception as e:
-            print(f"❌ Ошибка обновления кейса: {e}")
+            logger.exception("❌ Ошибка обновления кейса: %s", e)
             return False
     
     async def delete_case(self, case_id: int) -> bool:
         """Удаление кейса"""
         try:
-            async with self.db.async_session() as session:
-                stmt = select(Case).where(Case.id == case_id)
+            async with self._write_lock, self.db.async_session() as session:
+                # Связи с подарками нужны каскадному удалению - загружаем их тем же запросом
+                stmt = select(Case).where(Case.id == case_id).options(
+                    selectinload(Case.case_presents), *self._load_guard
+                )
                 result = await session.execute(stmt)
                 case = result.scalar_one_or_none()
                 
@@ -269,34 +501,37 @@ class CaseRepository:
                     return False
                 
                 await session.delete(case)
+                await self._notify_changed(session, case_id)
                 await session.commit()
+                self._cache.pop(case_id, None)
+                self._bump_version()
                 return True
                 
         except Exception as e:
-            print(f"❌ Ошибка удаления кейса: {e}")
+            logger.exception("❌ Ошибка удаления кейса: %s", e)
             return False
     
-    async def case_exists(self, case_id: int) -> bool:
-        """Проверка существования кейса"""
+    async def case_exists(self, case_id: int, session: Optional[AsyncSession] = None) -> bool:
+        """Проверка существования кейса (по кэшу, если он заполнен и нет внешней сессии)"""
+        if session is None and self._cache_ready:
+            return case_id in self._cache
         try:
-            async with self.db.async_session() as session:
-                stmt = select(func.count(Case.id)).where(Case.id == case_id)
-                result = await session.execute(stmt)
-                count = result.scalar()
-                return count > 0
+            async with self.db.session_scope(session) as session:
+                stmt = select(exists().where(Case.id == case_id))
+                return bool(await session.scalar(stmt))
         except Exception as e:
-            print(f"❌ Ошибка проверки существования кейса: {e}")
+            logger.exception("❌ Ошибка проверки существования кейса: %s", e)
             return False
     
-    async def get_cases_count(self) -> int:
+    async def get_cases_count(self, session: Optional[AsyncSession] = None) -> int:
         """Получение количества кейсов"""
         try:
-            async with self.db.async_session() as session:
+            async with self.db.session_scope(session) as session:
                 stmt = select(func.count(Case.id))
                 result = await session.execute(stmt)
                 return result.scalar() or 0
         except Exception as e:
-            print(f"❌ Ошибка подсчета кейсов: {e}")
+            logger.exception("❌ Ошибка подсчета кейсов: %s", e)
             return 0
 
 
@@ -309,6 +544,11 @@ class CaseManager:
     async def initialize(self):
         """Инициализация менеджера кейсов"""
         await self.repository.init_tables()
+        await self.repository.start_listening()
+    
+    async def close(self):
+        """Остановка подписки на изменения кейсов"""
+        await self.repository.stop_listening()
     
     def validate_case_name(self, name: str) -> tuple[bool, str]:
         """Валидация названия кейса"""
@@ -342,6 +582,8 @@ class CaseManager:
                 return False, (0, 0.0), "Стоимость подарка должна быть положительной"
             if prob <= 0 or prob > 100:
                 return False, (0, 0.0), "Вероятность должна быть от 0 до 100%"
+            if abs(prob * 100 - _to_basis_points(prob)) > 1e-6:
+                return False, (0, 0.0), "Вероятность указывается с точностью до 0.01%"
             
             return True, (cost, prob), ""
         except ValueError:
@@ -352,8 +594,8 @@ class CaseManager:
         if not presents:
             return False, "Список подарков не может быть пустым"
         
-        total_prob = sum(prob for _, prob in presents)
-        if not (99.99 <= total_prob <= 100.01):
-            return False, f"Сумма вероятностей должна быть 100%, а не {total_prob}%"
+        total = sum(_to_basis_points(prob) for _, prob in presents)
+        if total != _BASIS_POINTS:
+            return False, f"Сумма вероятностей должна быть 100%, а не {total / 100}%"
         
         return True, "" 
\ No newline at end of file
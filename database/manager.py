@@ -1,71 +1,326 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+import functools
+import inspect
+import logging
+import os
+import asyncio
+from asyncio import current_task
+from uuid import uuid4
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import (
+    create_async_engine, AsyncEngine, AsyncSession, async_sessionmaker, async_scoped_session
+)
 from .models import Base
+from .schema import upgrade_schema
+
+
+logger = logging.getLogger(__name__)
+
+
+# Параметры пула соединений (PostgreSQL), настраиваются через окружение
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "40"))
+# При исчерпании пула лучше быстро получить ошибку, чем копить очередь корутин
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "5"))
+# Отдельный пул asyncpg для горячих чтений в обход SQLAlchemy (только postgresql+asyncpg)
+RAW_POOL_MIN_SIZE = 5
+RAW_POOL_MAX_SIZE = 20
+RAW_POOL_MAX_INACTIVE = 600
+RAW_POOL_MAX_QUERIES = 10000
+# Сколько строк пакетной вставки уходит одним INSERT ... VALUES (...), (...)
+DB_INSERT_PAGE_SIZE = 1000
+
+# Режимы подготовленных выражений asyncpg (см. _asyncpg_connect_args):
+# - по умолчанию кэши выключены: после изменения схемы закэшированные планы
+#   становятся недействительными (InvalidCachedStatementError);
+# - ASYNCPG_STATEMENT_CACHE=true, прямое подключение к PostgreSQL: повторяющиеся запросы
+#   (по user_id, payment_id, case_id) выполняются без разбора и планирования -
+#   statement_cache_size=2048 в asyncpg и prepared_statement_cache_size=100 в SQLAlchemy;
+# - PGBOUNCER=true, pgbouncer в режиме transaction pooling: подготовленные выражения не
+#   переживают смену серверного соединения, поэтому кэши выключены всегда (даже при
+#   ASYNCPG_STATEMENT_CACHE), а имена выражений уникальны, чтобы не столкнуться с чужими
+#   на общем серверном соединении
+PGBOUNCER = os.getenv("PGBOUNCER", "false").lower() in ("1", "true")
+STATEMENT_CACHE = os.getenv("ASYNCPG_STATEMENT_CACHE", "false").lower() in ("1", "true") and not PGBOUNCER
+
+
+def _asyncpg_connect_args() -> dict:
+    """
+    Параметры подключения asyncpg: кэш подготовленных выражений, отключенный JIT
+    и TCP keepalive, чтобы мертвые соединения пула обнаруживались без pre-ping
+    """
+    args = {
+        "statement_cache_size": 2048 if STATEMENT_CACHE else 0,
+        "prepared_statement_cache_size": 100 if STATEMENT_CACHE else 0,
+        "server_settings": {
+            "jit": "off",
+            "tcp_keepalives_idle": "60",
+            "tcp_keepalives_interval": "10",
+            "tcp_keepalives_count": "3",
+        },
+    }
+    if PGBOUNCER:
+        args["prepared_statement_name_func"] = lambda: f"__asyncpg_{uuid4()}__"
+    return args
+
+
+# Счетчик SQL-запросов в рамках запроса (только DEV_MODE).
+# Храним изменяемый список, чтобы инкременты из дочерних задач были видны снаружи
+_statement_counter: ContextVar[Optional[List[int]]] = ContextVar("statement_counter", default=None)
+
+
+def start_statement_count() -> List[int]:
+    """Начать подсчет запросов для текущего контекста"""
+    counter = [0]
+    _statement_counter.set(counter)
+    return counter
+
+
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    counter = _statement_counter.get()
+    if counter is not None:
+        counter[0] += 1
+
+
+def _install_statement_counter(engine):
+    event.listen(engine.sync_engine, "before_cursor_execute", _count_statement)
+
+
+def _create_engine(database_url: str, dev_mode: bool) -> AsyncEngine:
+    """Создание движка с настройками пула под диалект"""
+    if "postgresql" in database_url:
+        engine = create_async_engine(
+            database_url, 
+            echo=dev_mode, 
+            # Пул по умолчанию для async-движка, задан явно: ожидание свободного
+            # соединения не блокирует event loop
+            poolclass=AsyncAdaptedQueuePool,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_reset_on_return="commit",
+            # Без pool_pre_ping: лишний SELECT 1 на каждую выдачу соединения.
+            # Устаревшие соединения отсекают pool_recycle, keepalive и retry_on_disconnect
+            pool_recycle=3600,
+            insertmanyvalues_page_size=DB_INSERT_PAGE_SIZE,
+            connect_args=_asyncpg_connect_args() if "asyncpg" in database_url else {}
+        )
+    else:
+        # SQLite: пул по умолчанию для диалекта, без настроек размера
+        engine = create_async_engine(
+            database_url,
+            echo=dev_mode,
+            insertmanyvalues_page_size=DB_INSERT_PAGE_SIZE,
+            connect_args={"check_same_thread": False}
+        )
+    
+    if dev_mode:
+        _install_statement_counter(engine)
+    return engine
+
+
+def retry_on_disconnect(func):
+    """
+    Повтор операции один раз, если соединение из пула оказалось разорванным.
+    Только для чтений: повтор записи после обрыва мог бы применить её дважды.
+    Не повторяется ни с сессией вызывающего, ни внутри сессии запроса (её подхватывает
+    session_scope): сессия уже на разорванном соединении, закрывает её владелец.
+    Декорируемые методы - методы менеджеров с атрибутом db_manager
+    """
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        try:
+            return await func(*args, **kwargs)
+        except DBAPIError as e:
+            if not e.connection_invalidated:
+                raise
+            arguments = signature.bind_partial(*args, **kwargs).arguments
+            if arguments.get("session") is not None:
+                raise
+            if arguments["self"].db_manager.scoped_session.registry.has():
+                raise
+            # Соединение уже помечено недействительным и не вернется в пул
+            return await func(*args, **kwargs)
+    return wrapper
+
+
+# Один движок (и один пул) на URL в процессе, сколько бы DatabaseManager ни создавалось
+_engines: Dict[Tuple[str, bool], AsyncEngine] = {}
+
+
+def _get_engine(database_url: str, dev_mode: bool) -> AsyncEngine:
+    key = (database_url, dev_mode)
+    engine = _engines.get(key)
+    if engine is None:
+        engine = _engines[key] = _create_engine(database_url, dev_mode)
+    return engine
+
+
+def _reset_engines_after_fork():
+    """В дочернем процессе не используем унаследованные от родителя сокеты пула"""
+    for engine in _engines.values():
+        engine.sync_engine.dispose(close=False)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_engines_after_fork)
 
 
 class DatabaseManager:
     """Основной менеджер для работы с базой данных"""
     
-    def __init__(self, database_url: str):
+    def __init__(self, database_url: str, dev_mode: bool = False):
         """Инициализация менеджера базы данных"""
-        if "postgresql" in database_url:
-            self.engine = create_async_engine(
-                database_url, 
-                echo=False, 
-                pool_size=10,
-                max_overflow=20,
-                pool_pre_ping=True,
-                pool_recycle=3600,
-                logging_name=None
-            )
-        else:
-            self.engine = create_async_engine(database_url, echo=True)
-            
+        self.dev_mode = dev_mode
+        self.engine = _get_engine(str(database_url), dev_mode)
+        # Одиночные SELECT без BEGIN/COMMIT вокруг запроса
+        self.read_engine = self.engine.execution_options(isolation_level="AUTOCOMMIT")
         self.async_session = async_sessionmaker(
             self.engine,
             class_=AsyncSession,
             expire_on_commit=False
         )
+        # ORM-чтения вне транзакции: без BEGIN/COMMIT вокруг SELECT
+        self.read_session = async_sessionmaker(
+            self.read_engine,
+            class_=AsyncSession,
+            expire_on_commit=False
+        )
+        # Сессия запроса: одна на задачу asyncio, открывается через request_session().
+        # Только для чтений, поэтому в AUTOCOMMIT: без транзакции на весь запрос и ROLLBACK в конце
+        self.scoped_session = async_scoped_session(self.read_session, scopefunc=current_task)
+        # Пул asyncpg создается в init_db; до этого (и для SQLite) чтения идут через SQLAlchemy
+        self.raw_pool = None
+
+    @asynccontextmanager
+    async def session_scope(self, session: Optional[AsyncSession] = None) -> AsyncIterator[AsyncSession]:
+        """
+        Сессия для одной операции чтения.
+        Если передана внешняя сессия или в текущей задаче открыта сессия запроса - используем её,
+        иначе открываем новую сессию в режиме AUTOCOMMIT и закрываем по выходу из контекста.
+        Записи идут через async_session с явным коммитом.
+        """
+        if session is None and self.scoped_session.registry.has():
+            session = self.scoped_session()
+        if session is not None:
+            yield session
+            return
+        async with self.read_session() as new_session:
+            yield new_session
+
+    @asynccontextmanager
+    async def request_session(self) -> AsyncIterator[AsyncSession]:
+        """
+        Сессия на весь обработчик: чтения через session_scope в этой задаче
+        идут в одной сессии (и одном соединении) вместо отдельной на каждый метод
+        """
+        try:
+            yield self.scoped_session()
+        finally:
+            await self.scoped_session.remove()
+
+    @asynccontextmanager
+    async def unit_of_work(self, session: Optional[AsyncSession] = None) -> AsyncIterator[AsyncSession]:
+        """
+        Сессия для записи в одной транзакции.
+        Если передана внешняя сессия - операция становится частью её транзакции, коммит делает
+        владелец; иначе открывается новая сессия, коммит - при выходе из контекста без исключения.
+        Действия из after_commit выполняются только после успешного коммита
+        """
+        if session is not None:
+            yield session
+            return
+        async with self.async_session() as new_session:
+            async with new_session.begin():
+                yield new_session
+            for callback in new_session.info.pop("after_commit", ()):
+                callback()
+
+    @staticmethod
+    def after_commit(session: AsyncSession, callback: Callable[[], None]):
+        """Отложить действие (например, обновление кэша) до коммита unit_of_work"""
+        session.info.setdefault("after_commit", []).append(callback)
 
     async def init_db(self):
         """Инициализация базы данных и создание таблиц"""
         try:
             async with self.engine.begin() as conn:
                 await conn.run_sync(Base.metadata.create_all)
-            print("✅ База данных инициализирована")
+                # Существующие таблицы create_all не меняет: доводим их до текущих моделей
+                await conn.run_sync(upgrade_schema)
+            if self.engine.dialect.driver == "asyncpg" and self.raw_pool is None:
+                await self._create_raw_pool()
+            await self._warm_pool()
+            logger.info("✅ База данных инициализирована")
         except Exception as e:
-            print(f"❌ Ошибка инициализации БД: {e}")
+            logger.exception("❌ Ошибка инициализации БД: %s", e)
             raise
 
-    async def clear_cache_and_reconnect(self):
-        """Принудительная очистка кэша и пересоздание подключения"""
-        try:
-            await self.engine.dispose()
-            print("🔄 Кэш SQLAlchemy очищен")
-
-            if "postgresql" in self.engine.url:
-                self.engine = create_async_engine(
-                    self.engine.url, 
-                    echo=False, 
-                    pool_size=10,
-                    max_overflow=20,
-                    pool_pre_ping=True,
-                    pool_recycle=3600,
-                    logging_name=None
-                )
-            else:
-                self.engine = create_async_engine(self.engine.url, echo=True)
-                
-            self.async_session = async_sessionmaker(
-                self.engine,
-                class_=AsyncSession,
-                expire_on_commit=False
-            )
-            print("✅ Подключение к базе данных пересоздано")
-        except Exception as e:
-            print(f"❌ Ошибка при очистке кэша: {e}")
-            raise
+    async def _warm_pool(self):
+        """
+        Заранее открыть pool_size соединений параллельно, чтобы первые запросы
+        после старта не ждали TCP/TLS-рукопожатия и аутентификации
+        """
+        pool = self.engine.pool
+        if not isinstance(pool, AsyncAdaptedQueuePool):
+            return
+        conns = [self.engine.connect() for _ in range(pool.size())]
+        results = await asyncio.gather(*(conn.start() for conn in conns), return_exceptions=True)
+        # Закрытие возвращает соединения в пул, а не разрывает их
+        await asyncio.gather(*(
+            conn.close() for conn, result in zip(conns, results)
+            if not isinstance(result, BaseException)
+        ))
+        failed = sum(isinstance(result, BaseException) for result in results)
+        if failed:
+            logger.warning("⚠️ Не удалось заранее открыть %s из %s соединений пула", failed, len(conns))
+
+    async def _create_raw_pool(self):
+        """Пул asyncpg с теми же параметрами подключения, что и у движка"""
+        import asyncpg
+        
+        # Параметры уровня диалекта SQLAlchemy asyncpg.create_pool не принимает
+        connect_args = _asyncpg_connect_args()
+        connect_args.pop("prepared_statement_cache_size")
+        connect_args.pop("prepared_statement_name_func", None)
+        self.raw_pool = await asyncpg.create_pool(
+            self._raw_dsn(),
+            min_size=RAW_POOL_MIN_SIZE,
+            max_size=RAW_POOL_MAX_SIZE,
+            max_inactive_connection_lifetime=RAW_POOL_MAX_INACTIVE,
+            max_queries=RAW_POOL_MAX_QUERIES,
+            **connect_args
+        )
+
+    def _raw_dsn(self) -> str:
+        return self.engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+
+    async def connect_listener(self):
+        """
+        Отдельное соединение asyncpg для LISTEN вне пулов: держится все время работы
+        и не отнимает соединение у запросов. Вызывающий закрывает его сам.
+        None - если LISTEN недоступен (не asyncpg или pgbouncer в режиме transaction pooling,
+        где подписка теряется при возврате серверного соединения)
+        """
+        if self.engine.dialect.driver != "asyncpg":
+            return None
+        if PGBOUNCER:
+            logger.warning("⚠️ PGBOUNCER=true: LISTEN через pgbouncer не работает, межпроцессная инвалидация отключена")
+            return None
+        import asyncpg
+
+        return await asyncpg.connect(self._raw_dsn())
 
     async def close(self):
         """Закрытие соединения с базой данных"""
+        if self.raw_pool is not None:
+            await self.raw_pool.close()
+            self.raw_pool = None
         await self.engine.dispose()
-        print("🔌 Соединение с базой данных закрыто") 
\ No newline at end of file
+        logger.info("🔌 Соединение с базой данных закрыто") 
\ No newline at end of file
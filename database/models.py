@@ -5,7 +5,7 @@ This module contains all SQLAlchemy model definitions for the database tables.
 """
 
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
-from sqlalchemy import BigInteger, String, DateTime, Integer, CheckConstraint, Float, ForeignKey, UniqueConstraint
+from sqlalchemy import func, text, BigInteger, String, DateTime, Integer, CheckConstraint, Float, ForeignKey, UniqueConstraint, Index
 from datetime import datetime
 from typing import Optional, List
 
@@ -20,7 +20,7 @@ class User(Base):
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(BigInteger, unique=True, nullable=False)
     username: Mapped[str] = mapped_column(String(255), nullable=True)
-    registration_date: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+    registration_date: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), nullable=False)
     fantics: Mapped[int] = mapped_column(Integer,
                                        nullable=False,
                                        default=0,
@@ -28,6 +28,9 @@ class User(Base):
 
     __table_args__ = (
         CheckConstraint('fantics >= 0', name='check_fantics_positive'),
+        # Покрывающий индекс для выборок по user_id (баланс, username):
+        # index-only scan без обращения к таблице (PostgreSQL)
+        Index('ix_users_user_id_covering', 'user_id', postgresql_include=['fantics', 'username']),
     )
 
     ton_wallets: Mapped[List["TonWallet"]] = relationship(
@@ -44,16 +47,22 @@ class TonWallet(Base):
     
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     user_id: Mapped[int] = mapped_column(ForeignKey("users.user_id", ondelete="CASCADE"))
-    wallet_address: Mapped[str] = mapped_column(String(67), nullable=False, unique=True)
+    wallet_address: Mapped[str] = mapped_column(String(67), nullable=False)
     network: Mapped[Optional[str]] = mapped_column(String(10), nullable=True)  # -239, 0, etc.
     public_key: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)  # Public key в hex
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
     is_active: Mapped[bool] = mapped_column(default=True)
     
     user: Mapped["User"] = relationship(back_populates="ton_wallets")
 
     __table_args__ = (
         UniqueConstraint('user_id', 'wallet_address', name='_user_wallet_uc'),
+        # Адрес уникален только среди активных кошельков: отключенный адрес можно привязать заново
+        Index('uq_ton_wallets_address_active', 'wallet_address', unique=True,
+              postgresql_where=text('is_active'), sqlite_where=text('is_active')),
+        # Частичный индекс только по активным кошелькам для get_user_ton_wallets
+        Index('ix_ton_wallets_user_active', 'user_id', 'is_active',
+              postgresql_where=text('is_active'), sqlite_where=text('is_active')),
     )
 
     def __repr__(self):
@@ -66,8 +75,11 @@ class Case(Base):
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     name: Mapped[str] = mapped_column(String(255), nullable=False, unique=True)
     cost: Mapped[int] = mapped_column(Integer, nullable=False)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
-    updated_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now, onupdate=datetime.now)
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+    updated_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now(), onupdate=func.now())
+
+    # Время ставит БД: забираем его через RETURNING сразу после INSERT/UPDATE
+    __mapper_args__ = {"eager_defaults": True}
     
     case_presents: Mapped[List["CasePresent"]] = relationship(
         back_populates="case", 
@@ -103,9 +115,17 @@ class PendingPayment(Base):
     transaction_hash: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
     destination_address: Mapped[str] = mapped_column(String(255), nullable=False)
     comment: Mapped[str] = mapped_column(String(255), nullable=False)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
     confirmed_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
     expires_at: Mapped[datetime] = mapped_column(DateTime, nullable=False)
+
+    __table_args__ = (
+        # Платежи пользователя по статусу
+        Index('ix_pending_payments_user_status', 'user_id', 'status'),
+        # Поиск и истечение ожидающих платежей: частичный индекс только по pending, диапазон по сроку
+        Index('ix_pending_payments_pending_expires', 'expires_at',
+              postgresql_where=text("status = 'pending'"), sqlite_where=text("status = 'pending'")),
+    )
     
     def __repr__(self):
         return f"<PendingPayment(id={self.id}, payment_id='{self.payment_id}', user_id={self.user_id}, status='{self.status}')>"
@@ -122,7 +142,12 @@ class SuccessfulPayment(Base):
     sender_wallet: Mapped[Optional[str]] = mapped_column(String(67), nullable=True)  # адрес кошелька отправителя (для TON)
     transaction_hash: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)  # хэш транзакции (для TON)
     payment_id: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)  # ID платежа из pending_payments
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
+
+    __table_args__ = (
+        # История платежей пользователя постранично: keyset по id
+        Index('ix_successful_payments_user_id', 'user_id', 'id'),
+    )
     
     def __repr__(self):
         return f"<SuccessfulPayment(id={self.id}, user_id={self.user_id}, method='{self.payment_method}', amount_fantics={self.amount_fantics}, amount_paid={self.amount_paid})>"
@@ -140,7 +165,7 @@ class WithdrawalRequest(Base):
     status: Mapped[str] = mapped_column(String(50), nullable=False, default='pending')  # pending, processing, completed, failed, cancelled
     transaction_hash: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
     error_message: Mapped[Optional[str]] = mapped_column(String(500), nullable=True)
-    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+    created_at: Mapped[datetime] = mapped_column(DateTime, server_default=func.now())
     processed_at: Mapped[Optional[datetime]] = mapped_column(DateTime, nullable=True)
     
     def __repr__(self):
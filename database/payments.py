@@ -7,11 +7,29 @@ This module provides PaymentManager class for:
 - Payment statistics and verification
 """
 
-from sqlalchemy import select, func
-from datetime import datetime, timedelta
-from typing import Optional, List
+import asyncio
+import logging
+from sqlalchemy import select, update, func, bindparam, Interval
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import timedelta
+from typing import AsyncIterator, Optional, List, Dict, Any
 from .models import PendingPayment, SuccessfulPayment
-from .manager import DatabaseManager
+from .manager import DatabaseManager, DB_INSERT_PAGE_SIZE
+
+
+logger = logging.getLogger(__name__)
+
+# Период фоновой проверки истекших pending платежей, секунды
+PAYMENT_EXPIRY_SWEEP_INTERVAL = 60
+
+
+def _ttl_param(dialect_name: str, minutes: int):
+    """Значение параметра ttl для вставки pending платежей (см. PaymentManager._build_statements)"""
+    if dialect_name == "sqlite":
+        return f'{int(minutes):+d} minutes'
+    return timedelta(minutes=minutes)
 
 
 class PaymentManager:
@@ -20,6 +38,52 @@ class PaymentManager:
     def __init__(self, db_manager: DatabaseManager):
         self.db_manager = db_manager
         self.async_session = db_manager.async_session
+        self._dialect_name = db_manager.engine.dialect.name
+        self._expiry_sweeper: Optional[asyncio.Task] = None
+        self._build_statements()
+
+    def _build_statements(self):
+        """Подготовка выражений для горячих запросов один раз, параметры через bindparam"""
+        self._get_pending_payment_stmt = select(PendingPayment).where(
+            PendingPayment.payment_id == bindparam("payment_id")
+        )
+        self._payment_by_hash_stmt = select(PendingPayment).where(
+            PendingPayment.transaction_hash == bindparam("transaction_hash")
+        )
+        self._pending_for_verification_stmt = select(PendingPayment).where(
+            PendingPayment.status == 'pending',
+            PendingPayment.expires_at > func.now()
+        ).limit(bindparam("limit"))
+        self._iter_pending_for_verification_stmt = select(PendingPayment).where(
+            PendingPayment.status == 'pending',
+            PendingPayment.expires_at > func.now()
+        )
+        self._expire_payments_stmt = update(PendingPayment).where(
+            PendingPayment.status == 'pending',
+            PendingPayment.expires_at <= func.now()
+        ).values(status='expired')
+        # Срок платежа сравнивается с now() самой БД - тем же часами, что поставили expires_at
+        self._expire_payment_if_due_stmt = update(PendingPayment).where(
+            PendingPayment.payment_id == bindparam("pid"),
+            PendingPayment.status == 'pending',
+            PendingPayment.expires_at <= func.now()
+        ).values(status='expired').returning(PendingPayment.id)
+        
+        # Создание платежей: срок жизни каждой строки БД считает от своего now() по параметру ttl,
+        # повтор с тем же payment_id ничего не вставляет (идемпотентно, без предварительного SELECT)
+        if self._dialect_name == "sqlite":
+            insert = sqlite_insert
+            expires_at = func.datetime('now', bindparam("ttl"))
+        else:
+            insert = pg_insert
+            expires_at = func.now() + bindparam("ttl", type_=Interval())
+        payments = PendingPayment.__table__
+        self._insert_pending_payments_stmt = (
+            insert(payments)
+            .values(expires_at=expires_at)
+            .on_conflict_do_nothing(index_elements=[payments.c.payment_id])
+            .returning(payments.c.id)
+        )
 
     # ========== МЕТОДЫ ДЛЯ РАБОТЫ С PENDING ПЛАТЕЖАМИ ==========
     
@@ -34,114 +98,188 @@ class PaymentManager:
         comment: str,
         expires_in_minutes: int = 30
     ) -> bool:
-        """Создание записи о pending платеже"""
+        """Создание записи о pending платеже (повторный вызов с тем же payment_id ничего не меняет)"""
         try:
             async with self.async_session() as session:
-                expires_at = datetime.now() + timedelta(minutes=expires_in_minutes)
-                
-                payment = PendingPayment(
-                    payment_id=payment_id,
-                    user_id=user_id,
-                    amount_fantics=amount_fantics,
-                    amount_ton=amount_ton,
-                    payment_method=payment_method,
-                    status='pending',
-                    destination_address=destination_address,
-                    comment=comment,
-                    expires_at=expires_at
-                )
-                
-                session.add(payment)
+                params = {
+                    "payment_id": payment_id,
+                    "user_id": user_id,
+                    "amount_fantics": amount_fantics,
+                    "amount_ton": amount_ton,
+                    "payment_method": payment_method,
+                    "status": 'pending',
+                    "destination_address": destination_address,
+                    "comment": comment,
+                    # Срок жизни считает БД относительно своего now(), как и created_at
+                    "ttl": _ttl_param(self._dialect_name, expires_in_minutes),
+                }
+                result = await session.execute(self._insert_pending_payments_stmt, params)
+                inserted = result.scalar_one_or_none() is not None
                 await session.commit()
                 
-                print(f"💰 Создан pending платеж {payment_id} для пользователя {user_id} на {amount_fantics} фантиков")
+                if inserted:
+                    logger.debug("💰 Создан pending платеж %s для пользователя %s на %s фантиков", payment_id, user_id, amount_fantics)
+                else:
+                    logger.warning("⚠️ Pending платеж %s уже существует", payment_id)
                 return True
                 
         except Exception as e:
-            print(f"❌ Ошибка создания pending платежа: {e}")
+            logger.exception("❌ Ошибка создания pending платежа: %s", e)
             return False
     
-    async def get_pending_payment(self, payment_id: str) -> Optional[PendingPayment]:
-        """Получение pending платежа по ID"""
+    async def create_pending_payments_bulk(self, payments: List[Dict[str, Any]]) -> List[int]:
+        """
+        Пакетное создание pending платежей многострочным INSERT ... RETURNING
+        :param payments: Словари с ключами payment_id, user_id, amount_fantics, amount_ton,
+                         payment_method, destination_address, comment и необязательным expires_in_minutes
+        :return: id созданных записей; уже существующие payment_id пропускаются (пустой список при ошибке)
+        """
+        if not payments:
+            return []
         try:
             async with self.async_session() as session:
-                stmt = select(PendingPayment).where(PendingPayment.payment_id == payment_id)
-                result = await session.execute(stmt)
+                params = [
+                    {
+                        "payment_id": payment["payment_id"],
+                        "user_id": payment["user_id"],
+                        "amount_fantics": payment["amount_fantics"],
+                        "amount_ton": payment["amount_ton"],
+                        "payment_method": payment["payment_method"],
+                        "status": 'pending',
+                        "destination_address": payment["destination_address"],
+                        "comment": payment["comment"],
+                        "ttl": _ttl_param(self._dialect_name, payment.get("expires_in_minutes", 30)),
+                    }
+                    for payment in payments
+                ]
+                
+                ids = []
+                for start in range(0, len(params), DB_INSERT_PAGE_SIZE):
+                    result = await session.execute(
+                        self._insert_pending_payments_stmt, params[start:start + DB_INSERT_PAGE_SIZE]
+                    )
+                    ids.extend(result.scalars().all())
+                await session.commit()
+                
+                logger.info("💰 Пакетно создано pending платежей: %s из %s", len(ids), len(params))
+                return ids
+                
+        except Exception as e:
+            logger.exception("❌ Ошибка пакетного создания pending платежей: %s", e)
+            return []
+    
+    async def get_pending_payment(self, payment_id: str, session: Optional[AsyncSession] = None) -> Optional[PendingPayment]:
+        """Получение pending платежа по ID"""
+        try:
+            async with self.db_manager.session_scope(session) as session:
+                result = await session.execute(self._get_pending_payment_stmt, {"payment_id": payment_id})
                 return result.scalar_one_or_none()
         except Exception as e:
-            print(f"❌ Ошибка получения pending платежа: {e}")
+            logger.exception("❌ Ошибка получения pending платежа: %s", e)
             return None
     
     async def update_payment_status(
         self, 
         payment_id: str, 
         status: str, 
-        transaction_hash: Optional[str] = None
+        transaction_hash: Optional[str] = None,
+        session: Optional[AsyncSession] = None
     ) -> bool:
-        """Обновление статуса платежа"""
+        """Обновление статуса платежа (с внешней сессией - в её транзакции, без коммита)"""
         try:
-            async with self.async_session() as session:
-                stmt = select(PendingPayment).where(PendingPayment.payment_id == payment_id)
-                result = await session.execute(stmt)
+            async with self.db_manager.unit_of_work(session) as session:
+                result = await session.execute(self._get_pending_payment_stmt, {"payment_id": payment_id})
                 payment = result.scalar_one_or_none()
                 
                 if not payment:
-                    print(f"❌ Pending платеж {payment_id} не найден")
+                    logger.warning("❌ Pending платеж %s не найден", payment_id)
                     return False
                 
                 payment.status = status
                 if transaction_hash:
                     payment.transaction_hash = transaction_hash
                 if status == 'confirmed':
-                    payment.confirmed_at = datetime.now()
+                    payment.confirmed_at = func.now()
                 
-                await session.commit()
-                print(f"✅ Статус платежа {payment_id} обновлен на '{status}'")
+                await session.flush()
+                logger.debug("✅ Статус платежа %s обновлен на '%s'", payment_id, status)
                 return True
                 
         except Exception as e:
-            print(f"❌ Ошибка обновления статуса платежа: {e}")
+            logger.exception("❌ Ошибка обновления статуса платежа: %s", e)
             return False
     
     async def get_pending_payments_for_verification(self, limit: int = 50) -> List[PendingPayment]:
         """Получение pending платежей для проверки"""
         try:
             async with self.async_session() as session:
-                stmt = select(PendingPayment).where(
-                    PendingPayment.status == 'pending',
-                    PendingPayment.expires_at > datetime.now()
-                ).limit(limit)
-                result = await session.execute(stmt)
+                result = await session.execute(self._pending_for_verification_stmt, {"limit": limit})
                 return result.scalars().all()
         except Exception as e:
-            print(f"❌ Ошибка получения pending платежей: {e}")
+            logger.exception("❌ Ошибка получения pending платежей: %s", e)
             return []
     
+    async def iter_pending_payments_for_verification(self, batch_size: int = 500) -> AsyncIterator[PendingPayment]:
+        """
+        Потоковый обход всех pending платежей для проверки через серверный курсор,
+        пачками по batch_size: обработка первых платежей начинается до загрузки остальных
+        """
+        stmt = self._iter_pending_for_verification_stmt.execution_options(yield_per=batch_size)
+        async with self.async_session() as session:
+            result = await session.stream_scalars(stmt)
+            async for payment in result:
+                yield payment
+    
     async def expire_old_payments(self) -> int:
-        """Помечает истекшие платежи как expired"""
+        """Помечает истекшие платежи как expired одним UPDATE (по индексу status, expires_at)"""
         try:
             async with self.async_session() as session:
-                stmt = select(PendingPayment).where(
-                    PendingPayment.status == 'pending',
-                    PendingPayment.expires_at <= datetime.now()
-                )
-                result = await session.execute(stmt)
-                expired_payments = result.scalars().all()
-                
-                count = 0
-                for payment in expired_payments:
-                    payment.status = 'expired'
-                    count += 1
-                
+                result = await session.execute(self._expire_payments_stmt)
                 await session.commit()
+                
+                count = result.rowcount
                 if count > 0:
-                    print(f"⏰ Помечено {count} платежей как истекшие")
+                    logger.info("⏰ Помечено %s платежей как истекшие", count)
                 return count
                 
         except Exception as e:
-            print(f"❌ Ошибка при истечении платежей: {e}")
+            logger.exception("❌ Ошибка при истечении платежей: %s", e)
             return 0
 
+    async def expire_payment_if_due(self, payment_id: str) -> bool:
+        """Пометить платеж как expired, если его срок истек; True - платеж истек"""
+        try:
+            async with self.async_session() as session:
+                result = await session.execute(self._expire_payment_if_due_stmt, {"pid": payment_id})
+                expired = result.scalar_one_or_none() is not None
+                await session.commit()
+                return expired
+        except Exception as e:
+            logger.exception("❌ Ошибка проверки срока платежа: %s", e)
+            return False
+
+    async def _expiry_sweep_loop(self, interval: float):
+        """Фоновая задача: периодически помечает истекшие pending платежи"""
+        while True:
+            await self.expire_old_payments()
+            await asyncio.sleep(interval)
+
+    def start_expiry_sweep(self, interval: float = PAYMENT_EXPIRY_SWEEP_INTERVAL):
+        """Запуск периодической проверки истекших платежей"""
+        if self._expiry_sweeper is None or self._expiry_sweeper.done():
+            self._expiry_sweeper = asyncio.create_task(self._expiry_sweep_loop(interval))
+
+    async def stop_expiry_sweep(self):
+        """Остановка периодической проверки истекших платежей"""
+        if self._expiry_sweeper is None:
+            return
+        self._expiry_sweeper.cancel()
+        try:
+            await self._expiry_sweeper
+        except asyncio.CancelledError:
+            pass
+        self._expiry_sweeper = None
+
     # ========== МЕТОДЫ ДЛЯ РАБОТЫ С УСПЕШНЫМИ ПЛАТЕЖАМИ ==========
     
     async def add_successful_payment(
@@ -152,11 +290,12 @@ class PaymentManager:
         amount_paid: float,
         sender_wallet: Optional[str] = None,
         transaction_hash: Optional[str] = None,
-        payment_id: Optional[str] = None
+        payment_id: Optional[str] = None,
+        session: Optional[AsyncSession] = None
     ) -> bool:
-        """Добавление успешного платежа в базу данных"""
+        """Добавление успешного платежа в базу данных (с внешней сессией - в её транзакции, без коммита)"""
         try:
-            async with self.async_session() as session:
+            async with self.db_manager.unit_of_work(session) as session:
                 payment = SuccessfulPayment(
                     user_id=user_id,
                     payment_method=payment_method,
@@ -168,96 +307,80 @@ class PaymentManager:
                 )
                 
                 session.add(payment)
-                await session.commit()
+                await session.flush()
                 
-                print(f"✅ Успешный платеж записан: пользователь {user_id}, метод {payment_method}, {amount_fantics} фантиков за {amount_paid}")
+                logger.debug(
+                    "✅ Успешный платеж записан: пользователь %s, метод %s, %s фантиков за %s",
+                    user_id, payment_method, amount_fantics, amount_paid
+                )
                 return True
                 
         except Exception as e:
-            print(f"❌ Ошибка записи успешного платежа: {e}")
+            logger.exception("❌ Ошибка записи успешного платежа: %s", e)
             return False
     
-    async def get_user_successful_payments(
-        self, 
-        user_id: int, 
-        limit: int = 50
+    async def get_successful_payments_page(
+        self,
+        user_id: Optional[int] = None,
+        limit: int = 50,
+        before_id: Optional[int] = None
     ) -> List[SuccessfulPayment]:
-        """Получение истории успешных платежей пользователя"""
+        """
+        Страница успешных платежей от новых к старым (keyset-пагинация вместо OFFSET).
+        id растет вместе с created_at (оба ставит БД при вставке), поэтому курсор - только id
+        :param user_id: Только платежи пользователя (None - все, для админа)
+        :param before_id: id последнего платежа предыдущей страницы
+        """
         try:
             async with self.async_session() as session:
-                stmt = select(SuccessfulPayment).where(
-                    SuccessfulPayment.user_id == user_id
-                ).order_by(SuccessfulPayment.created_at.desc()).limit(limit)
+                stmt = select(SuccessfulPayment).order_by(SuccessfulPayment.id.desc()).limit(limit)
+                if user_id is not None:
+                    stmt = stmt.where(SuccessfulPayment.user_id == user_id)
+                if before_id is not None:
+                    stmt = stmt.where(SuccessfulPayment.id < before_id)
                 
                 result = await session.execute(stmt)
                 return result.scalars().all()
                 
         except Exception as e:
-            print(f"❌ Ошибка получения истории платежей: {e}")
+            logger.exception("❌ Ошибка получения страницы платежей: %s", e)
             return []
     
+    async def get_user_successful_payments(
+        self, 
+        user_id: int, 
+        limit: int = 50
+    ) -> List[SuccessfulPayment]:
+        """Получение истории успешных платежей пользователя (первая страница)"""
+        return await self.get_successful_payments_page(user_id=user_id, limit=limit)
+    
     async def get_all_successful_payments(
         self, 
         limit: int = 100
     ) -> List[SuccessfulPayment]:
-        """Получение всех успешных платежей (для админа)"""
-        try:
-            async with self.async_session() as session:
-                stmt = select(SuccessfulPayment).order_by(
-                    SuccessfulPayment.created_at.desc()
-                ).limit(limit)
-                
-                result = await session.execute(stmt)
-                return result.scalars().all()
-                
-        except Exception as e:
-            print(f"❌ Ошибка получения всех платежей: {e}")
-            return []
+        """Получение всех успешных платежей (для админа, первая страница)"""
+        return await self.get_successful_payments_page(limit=limit)
     
     async def get_payment_statistics(self) -> dict:
         """Получение статистики платежей"""
         try:
             async with self.async_session() as session:
-                # Общая статистика
-                total_payments = await session.scalar(
-                    select(func.count(SuccessfulPayment.id))
-                )
-                
-                # Статистика по методам оплаты
-                ton_payments = await session.scalar(
-                    select(func.count(SuccessfulPayment.id)).where(
-                        SuccessfulPayment.payment_method == 'ton'
-                    )
-                )
-                
-                stars_payments = await session.scalar(
-                    select(func.count(SuccessfulPayment.id)).where(
+                # Вся статистика одним проходом по таблице: условные агрегаты через FILTER
+                is_ton = SuccessfulPayment.payment_method == 'ton'
+                stmt = select(
+                    func.count(SuccessfulPayment.id).label("total_payments"),
+                    func.count(SuccessfulPayment.id).filter(is_ton).label("ton_payments"),
+                    func.count(SuccessfulPayment.id).filter(
                         SuccessfulPayment.payment_method == 'stars'
-                    )
+                    ).label("stars_payments"),
+                    func.coalesce(func.sum(SuccessfulPayment.amount_fantics), 0).label("total_fantics"),
+                    func.coalesce(func.sum(SuccessfulPayment.amount_paid).filter(is_ton), 0).label("total_ton"),
                 )
-                
-                # Общая сумма фантиков
-                total_fantics = await session.scalar(
-                    select(func.sum(SuccessfulPayment.amount_fantics))
-                ) or 0
-                
-                # Общая сумма в TON
-                total_ton = await session.scalar(
-                    select(func.sum(SuccessfulPayment.amount_paid)).where(
-                        SuccessfulPayment.payment_method == 'ton'
-                    )
-                ) or 0
-                
-                return {
-                    "total_payments": total_payments,
-                    "ton_payments": ton_payments,
-                    "stars_payments": stars_payments,
-                    "total_fantics": total_fantics,
-                    "total_ton": total_ton
-                }
+                result = await session.execute(stmt)
+                return dict(result.one()._mapping)
                 
         except Exception as e:
-            print(f"❌ Ошибка получения статистики платежей: {e}")
+            logger.exception("❌ Ошибка получения статистики платежей: %s", e)
             return {
                 "total_payments": 0,
                 "ton_payments": 0,
@@ -278,19 +401,18 @@ class PaymentManager:
                 return result.scalars().all()
                 
         except Exception as e:
-            print(f"❌ Ошибка получения pending платежей пользователя: {e}")
+            logger.exception("❌ Ошибка получения pending платежей пользователя: %s", e)
             return []
 
     async def get_payment_by_transaction_hash(self, transaction_hash: str) -> Optional[PendingPayment]:
         """Получение платежа по хэшу транзакции"""
         try:
             async with self.async_session() as session:
-                stmt = select(PendingPayment).where(
-                    PendingPayment.transaction_hash == transaction_hash
+                result = await session.execute(
+                    self._payment_by_hash_stmt, {"transaction_hash": transaction_hash}
                 )
-                result = await session.execute(stmt)
                 return result.scalar_one_or_none()
                 
         except Exception as e:
-            print(f"❌ Ошибка получения платежа по хэшу: {e}")
+            logger.exception("❌ Ошибка получения платежа по хэшу: %s", e)
             return None 
\ No newline at end of file
@@ -0,0 +1,110 @@
+"""
+Schema upgrade module for Telegram Casino API
+
+This module provides upgrade_schema function for:
+- Bringing tables created by older versions up to the current models
+- Creating indexes added after a table already existed
+- Dropping constraints and indexes the models no longer declare
+
+create_all только создает недостающие таблицы и не трогает существующие,
+поэтому все шаги здесь идемпотентны и выполняются при каждом init_db
+"""
+
+import logging
+from sqlalchemy.engine import Connection
+from sqlalchemy.schema import CreateIndex, CreateTable
+from .models import Base, TonWallet
+
+
+logger = logging.getLogger(__name__)
+
+# Индексы, замененные другими: удаляются, если остались от прошлых версий
+_OBSOLETE_INDEXES = (
+    "ix_pending_payments_status_expires",  # -> ix_pending_payments_pending_expires
+)
+
+
+def upgrade_schema(conn: Connection):
+    """Доводит схему существующей БД до текущих моделей (вызывается через run_sync)"""
+    if conn.dialect.name == "postgresql":
+        _upgrade_postgresql(conn)
+    elif conn.dialect.name == "sqlite":
+        _rebuild_sqlite_tables(conn)
+
+    for name in _OBSOLETE_INDEXES:
+        conn.exec_driver_sql(f'DROP INDEX IF EXISTS "{name}"')
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            conn.execute(CreateIndex(index, if_not_exists=True))
+
+
+def _upgrade_postgresql(conn: Connection):
+    """PostgreSQL: удаление старой уникальности адреса кошелька и недостающие DEFAULT"""
+    # Раньше wallet_address был уникален целиком, теперь - только среди активных кошельков
+    # (частичный индекс uq_ton_wallets_address_active)
+    constraints = conn.exec_driver_sql(
+        """
+        SELECT c.conname FROM pg_constraint c
+        JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = c.conkey[1]
+        WHERE c.conrelid = %(table)s::regclass AND c.contype = 'u'
+          AND cardinality(c.conkey) = 1 AND a.attname = 'wallet_address'
+        """,
+        {"table": TonWallet.__tablename__}
+    ).scalars().all()
+    for name in constraints:
+        conn.exec_driver_sql(f'ALTER TABLE {TonWallet.__tablename__} DROP CONSTRAINT "{name}"')
+        logger.warning("🛠️ Удалено ограничение %s: адрес кошелька уникален только среди активных", name)
+
+    # Столбцы, которым время теперь ставит БД (server_default), в старых таблицах без DEFAULT
+    without_default = set(conn.exec_driver_sql(
+        """
+        SELECT table_name, column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND column_default IS NULL
+        """
+    ).all())
+    ddl = conn.dialect.ddl_compiler(conn.dialect, None)
+    for table in Base.metadata.sorted_tables:
+        for column in table.columns:
+            if column.server_default is None or (table.name, column.name) not in without_default:
+                continue
+            default = ddl.get_column_default_string(column)
+            conn.exec_driver_sql(f'ALTER TABLE {table.name} ALTER COLUMN {column.name} SET DEFAULT {default}')
+            logger.warning("🛠️ %s.%s: установлен DEFAULT %s", table.name, column.name, default)
+
+
+def _normalize_ddl(sql: str) -> str:
+    return " ".join(sql.replace('"', "").split())
+
+
+def _rebuild_sqlite_tables(conn: Connection):
+    """
+    SQLite не умеет менять ограничения и DEFAULT существующих столбцов: таблица, чей
+    CREATE TABLE расходится с моделью, пересоздается с копированием данных
+    (порядок из документации SQLite: новая таблица, копия, DROP старой, RENAME)
+    """
+    for table in Base.metadata.sorted_tables:
+        row = conn.exec_driver_sql(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table.name,)
+        ).first()
+        if row is None:
+            continue
+        create_sql = str(CreateTable(table).compile(dialect=conn.dialect)).strip()
+        if _normalize_ddl(row[0]) == _normalize_ddl(create_sql):
+            continue
+
+        existing = {info[1] for info in conn.exec_driver_sql(f'PRAGMA table_info("{table.name}")')}
+        columns = ", ".join(f'"{column.name}"' for column in table.columns if column.name in existing)
+        # Индексы старой таблицы удаляем заранее: их имена займут индексы новой
+        indexes = conn.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+            (table.name,)
+        ).scalars().all()
+        for name in indexes:
+            conn.exec_driver_sql(f'DROP INDEX "{name}"')
+
+        new_name = f"_new_{table.name}"
+        conn.exec_driver_sql(create_sql.replace(f"CREATE TABLE {table.name} (", f"CREATE TABLE {new_name} (", 1))
+        conn.exec_driver_sql(f'INSERT INTO {new_name} ({columns}) SELECT {columns} FROM "{table.name}"')
+        conn.exec_driver_sql(f'DROP TABLE "{table.name}"')
+        conn.exec_driver_sql(f'ALTER TABLE {new_name} RENAME TO "{table.name}"')
+        logger.warning("🛠️ Таблица %s пересоздана по текущей модели", table.name)
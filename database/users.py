@@ -7,12 +7,49 @@ This module provides UserManager class for:
 - Atomic transactions for balance operations
 """
 
-from sqlalchemy import select, func
+import asyncio
+import functools
+import logging
+from sqlalchemy import select, func, update, delete, bindparam, text, Row
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.asyncio import AsyncSession
-from datetime import datetime
-from typing import Optional, List, Tuple
-from .models import User
-from .manager import DatabaseManager
+from sqlalchemy.orm import raiseload, selectinload
+from typing import AsyncIterator, Optional, List, Dict, Sequence, Tuple
+from .models import User, TonWallet
+from .manager import DatabaseManager, DB_INSERT_PAGE_SIZE, retry_on_disconnect
+from .cache import TTLCache
+
+
+logger = logging.getLogger(__name__)
+
+# Отложенная запись username: размер очереди, пачки и кэша известных пользователей
+USERNAME_QUEUE_SIZE = 10_000
+USERNAME_BATCH_SIZE = 500
+KNOWN_USERS_LIMIT = 100_000
+# Кэш балансов для повторных перерисовок меню: короткий TTL, обновляется при каждой записи
+FANTICS_CACHE_SIZE = 50_000
+FANTICS_CACHE_TTL = 5
+# Кэш строк пользователей (get_user_row): ORM-объекты не кэшируются, они привязаны к сессии
+USER_ROW_CACHE_SIZE = 8192
+USER_ROW_CACHE_TTL = 2
+
+
+def _db_op(error_message: str, default=None):
+    """
+    Общая обработка ошибок БД для методов менеджера:
+    логирует исключение и возвращает default (или default(e), если это функция)
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                logger.exception("❌ %s: %s", error_message, e)
+                return default(e) if callable(default) else default
+        return wrapper
+    return decorator
 
 
 class UserManager:
@@ -21,292 +58,543 @@ class UserManager:
     def __init__(self, db_manager: DatabaseManager):
         self.db_manager = db_manager
         self.async_session = db_manager.async_session
+        self._build_statements(db_manager.engine.dialect.name)
+        
+        # user_id -> последний известный username для пользователей, уже записанных в БД
+        self._known_users: Dict[int, Optional[str]] = {}
+        # user_id -> первичный ключ users.id (не меняется), чтобы get_user шел через session.get
+        self._user_pks: Dict[int, int] = {}
+        self._username_queue: Optional[asyncio.Queue] = None
+        self._username_writer: Optional[asyncio.Task] = None
+        self._fantics_cache = TTLCache(FANTICS_CACHE_SIZE, FANTICS_CACHE_TTL)
+        self._user_row_cache = TTLCache(USER_ROW_CACHE_SIZE, USER_ROW_CACHE_TTL)
+
+    def _build_statements(self, dialect_name: str):
+        """
+        Подготовка выражений один раз при создании менеджера:
+        выбор диалекта для UPSERT не повторяется на каждом вызове,
+        а параметры передаются через bindparam
+        """
+        insert = pg_insert if dialect_name == "postgresql" else sqlite_insert
+        
+        stmt = insert(User).values(
+            user_id=bindparam("uid"),
+            username=bindparam("username")
+        )
+        # Обновляем username только если он действительно изменился
+        self._upsert_user_stmt = stmt.on_conflict_do_update(
+            index_elements=[User.user_id],
+            set_={"username": stmt.excluded.username},
+            where=User.username.is_distinct_from(stmt.excluded.username)
+        ).returning(User.id)
+        self._insert_user_stmt = stmt.on_conflict_do_nothing(
+            index_elements=[User.user_id]
+        ).returning(User.id)
+        # Пакетная вставка: RETURNING включает insertmanyvalues (многострочный VALUES)
+        self._insert_users_batch_stmt = insert(User).on_conflict_do_nothing(
+            index_elements=[User.user_id]
+        ).returning(User.user_id)
+        
+        # Пакетное обновление username (executemany, без RETURNING)
+        self._rename_user_stmt = (
+            update(User)
+            .where(User.user_id == bindparam("uid"))
+            .values(username=bindparam("new_username"))
+        )
+        
+        # Кошельки удаляются каскадом по FK, без обхода связей в ORM
+        self._delete_user_stmt = delete(User).where(User.user_id == bindparam("uid")).returning(User.id)
+        # В DEV_MODE случайное ленивое обращение к связям пользователя падает с ошибкой
+        self._user_load_options = [raiseload("*")] if self.db_manager.dev_mode else []
+        self._get_user_stmt = (
+            select(User)
+            .where(User.user_id == bindparam("uid"))
+            .options(*self._user_load_options)
+        )
+        self._get_user_row_stmt = select(User.user_id, User.username, User.fantics).where(
+            User.user_id == bindparam("uid")
+        )
+        self._get_user_with_wallets_stmt = (
+            select(User)
+            .where(User.user_id == bindparam("uid"))
+            .options(
+                selectinload(User.ton_wallets.and_(TonWallet.is_active == True)),
+                *self._user_load_options
+            )
+            # Уже загруженный в сессию пользователь получит отфильтрованный список заново
+            .execution_options(populate_existing=True)
+        )
+        self._get_fantics_stmt = select(User.fantics).where(User.user_id == bindparam("uid"))
+        self._users_count_stmt = select(func.count()).select_from(User)
+        # Оценка числа строк из статистики планировщика: без seq scan по всей таблице
+        self._users_count_approx_sql = (
+            f"SELECT reltuples::bigint FROM pg_class WHERE oid = '{User.__tablename__}'::regclass"
+            if dialect_name == "postgresql" else None
+        )
+        
+        self._add_fantics_stmt = (
+            update(User)
+            .where(User.user_id == bindparam("uid"))
+            .values(fantics=User.fantics + bindparam("amount"))
+            .returning(User.fantics)
+        )
+        # Достаточность баланса проверяет сама БД в условии UPDATE
+        self._subtract_fantics_stmt = (
+            update(User)
+            .where(User.user_id == bindparam("uid"), User.fantics >= bindparam("amount"))
+            .values(fantics=User.fantics - bindparam("amount"))
+            .returning(User.fantics)
+        )
+        # Открытие кейса: списание и выигрыш в одном UPDATE при достаточном балансе
+        self._case_transaction_stmt = (
+            update(User)
+            .where(User.user_id == bindparam("uid"), User.fantics >= bindparam("cost"))
+            .values(fantics=User.fantics - bindparam("cost") + bindparam("prize"))
+            .returning(User.fantics)
+        )
+        self._set_fantics_stmt = (
+            update(User)
+            .where(User.user_id == bindparam("uid"))
+            .values(fantics=bindparam("amount"))
+            .returning(User.fantics)
+        )
 
     # ========== МЕТОДЫ ДЛЯ РАБОТЫ С ПОЛЬЗОВАТЕЛЯМИ ==========
-    
+
+    @_db_op("Ошибка при добавлении пользователя в БД", False)
     async def add_user(self, user_id: int, username: Optional[str] = None) -> bool:
-        """Добавление пользователя в базу данных"""
-        try:
-            async with self.async_session() as session:
-                stmt = select(User).where(User.user_id == user_id)
-                result = await session.execute(stmt)
-                existing_user = result.scalar_one_or_none()
-
-                if existing_user:
-                    if username and existing_user.username != username:
-                        existing_user.username = username
-                        await session.commit()
-                        print(f"🔄 Username пользователя {user_id} обновлен на {username}")
-                    return True
-
-                new_user = User(
-                    user_id=user_id,
-                    username=username,
-                    registration_date=datetime.now()
+        """
+        Добавление пользователя в базу данных (или обновление username) одним запросом.
+        Для уже известного пользователя выполняется только INSERT ... ON CONFLICT DO NOTHING
+        (его могли удалить в другом процессе), а смена username не ждет записи:
+        она уходит в очередь и пишется фоновой задачей пачками
+        """
+        known = user_id in self._known_users
+        async with self.async_session() as session:
+            stmt = self._upsert_user_stmt if username and not known else self._insert_user_stmt
+            result = await session.execute(stmt, {"uid": user_id, "username": username})
+            changed = result.scalar_one_or_none() is not None
+            await session.commit()
+
+        renamed = not changed and known and username and self._known_users.get(user_id) != username
+        if len(self._known_users) >= KNOWN_USERS_LIMIT:
+            self._known_users.clear()
+        self._known_users[user_id] = username
+        if changed:
+            self._user_row_cache.pop(user_id)
+            logger.debug("➕ Пользователь %s сохранен в базе (username: %s)", user_id, username)
+        elif renamed:
+            self._enqueue_username(user_id, username)
+        return True
+
+    @_db_op("Ошибка при пакетном добавлении пользователей", 0)
+    async def add_users_batch(self, rows: Sequence[Tuple[int, Optional[str]]]) -> int:
+        """
+        Пакетное добавление пользователей: rows - пары (user_id, username).
+        Существующие пользователи пропускаются (username не обновляется).
+        Вставка идет многострочными INSERT по DB_INSERT_PAGE_SIZE строк, коммит один на весь пакет.
+        Возвращает количество реально добавленных пользователей
+        """
+        params = [{"user_id": user_id, "username": username} for user_id, username in rows]
+        if not params:
+            return 0
+        
+        inserted: List[int] = []
+        async with self.async_session() as session:
+            for start in range(0, len(params), DB_INSERT_PAGE_SIZE):
+                result = await session.execute(
+                    self._insert_users_batch_stmt, params[start:start + DB_INSERT_PAGE_SIZE]
                 )
-
-                session.add(new_user)
-                await session.commit()
-                print(f"➕ Пользователь {user_id} успешно добавлен в базу")
-                return True
-
-        except Exception as e:
-            print(f"❌ Ошибка при добавлении пользователя в БД: {e}")
-            return False
-
-    async def get_user(self, user_id: int) -> Optional[User]:
-        """Получение пользователя из базы данных"""
+                inserted.extend(result.scalars())
+            await session.commit()
+        
+        logger.info("➕ Пакетно добавлено пользователей: %s из %s", len(inserted), len(params))
+        return len(inserted)
+
+    def _enqueue_username(self, user_id: int, username: str):
+        """Поставить обновление username в очередь фоновой записи"""
+        if self._username_writer is None or self._username_writer.done():
+            self._username_queue = asyncio.Queue(USERNAME_QUEUE_SIZE)
+            self._username_writer = asyncio.create_task(self._username_writer_loop())
         try:
-            async with self.async_session() as session:
-                stmt = select(User).where(User.user_id == user_id)
-                result = await session.execute(stmt)
-                return result.scalar_one_or_none()
-        except Exception as e:
-            print(f"❌ Ошибка при получении пользователя из БД: {e}")
-            return None
-
-    async def get_all_users(self) -> List[User]:
-        """Получение всех пользователей из базы данных"""
+            self._username_queue.put_nowait((user_id, username))
+        except asyncio.QueueFull:
+            # Очередь переполнена - при следующем заходе username запишется через upsert
+            self._known_users.pop(user_id, None)
+            logger.warning("⚠️ Очередь обновления username переполнена, пропускаем %s", user_id)
+
+    async def _username_writer_loop(self):
+        """Фоновая задача: собирает обновления username в пачки и пишет их одной транзакцией"""
+        queue = self._username_queue
+        stopping = False
+        while not stopping:
+            batch = []
+            item = await queue.get()
+            while True:
+                if item is None:  # Сигнал остановки: дописываем то, что собрали
+                    stopping = True
+                    break
+                batch.append(item)
+                if len(batch) >= USERNAME_BATCH_SIZE or queue.empty():
+                    break
+                item = queue.get_nowait()
+            if batch:
+                await self._write_usernames(batch)
+
+    async def _write_usernames(self, batch: List[Tuple[int, str]]):
+        # Для одного пользователя в пачке побеждает последнее значение
+        rows = [{"uid": uid, "new_username": name} for uid, name in dict(batch).items()]
         try:
-            async with self.async_session() as session:
-                stmt = select(User)
-                result = await session.execute(stmt)
-                return list(result.scalars().all())
+            async with self.db_manager.engine.begin() as conn:
+                await conn.execute(self._rename_user_stmt, rows)
+            for row in rows:
+                self._user_row_cache.pop(row["uid"])
+            logger.debug("🔄 Обновлено username: %s", len(rows))
         except Exception as e:
-            print(f"❌ Ошибка при получении всех пользователей из БД: {e}")
-            return []
+            logger.exception("❌ Ошибка пакетного обновления username: %s", e)
+            for uid, _ in batch:
+                self._known_users.pop(uid, None)
+
+    async def stop_username_writer(self):
+        """Дописать накопленные обновления username и остановить фоновую задачу"""
+        if self._username_writer is None:
+            return
+        if not self._username_writer.done():
+            await self._username_queue.put(None)
+            await self._username_writer
+        self._username_writer = None
+
+    @_db_op("Ошибка при получении пользователя из БД")
+    @retry_on_disconnect
+    async def get_user(self, user_id: int, session: Optional[AsyncSession] = None) -> Optional[User]:
+        """
+        Получение пользователя из базы данных.
+        После первой загрузки ищем по первичному ключу через session.get:
+        повторный вызов в той же сессии (запроса) обходится без SQL, из identity map.
+        Запомненный ключ мог устареть (пользователя удалили и создали заново в другом
+        процессе) - тогда проверяем user_id и ищем заново по нему
+        """
+        pk = self._user_pks.get(user_id)
+        async with self.db_manager.session_scope(session) as session:
+            if pk is not None:
+                user = await session.get(User, pk, options=self._user_load_options)
+                if user is not None and user.user_id == user_id:
+                    return user
+                self._user_pks.pop(user_id, None)
+            user = await session.scalar(self._get_user_stmt, {"uid": user_id})
+            if user is not None:
+                if len(self._user_pks) >= KNOWN_USERS_LIMIT:
+                    self._user_pks.clear()
+                self._user_pks[user_id] = user.id
+            return user
+
+    @_db_op("Ошибка при получении пользователя из БД")
+    @retry_on_disconnect
+    async def get_user_row(self, user_id: int, session: Optional[AsyncSession] = None) -> Optional[Row]:
+        """
+        Пользователь для чтения: строка (user_id, username, fantics) без ORM-объекта,
+        с кэшем на пару секунд. Для изменения пользователя - get_user
+        """
+        cached = self._user_row_cache.get(user_id)
+        if cached is not None:
+            return cached
+        
+        token = self._user_row_cache.token()
+        params = {"uid": user_id}
+        if session is not None:
+            row = (await session.execute(self._get_user_row_stmt, params)).first()
+        else:
+            async with self.db_manager.read_engine.connect() as conn:
+                row = (await conn.execute(self._get_user_row_stmt, params)).first()
+        if row is not None:
+            self._user_row_cache.fill(user_id, row, token)
+        return row
+
+    @_db_op("Ошибка при получении пользователя с кошельками из БД")
+    @retry_on_disconnect
+    async def get_user_with_wallets(self, user_id: int, session: Optional[AsyncSession] = None) -> Optional[User]:
+        """
+        Пользователь вместе с активными TON кошельками: два запроса (users и ton_wallets по IN)
+        вместо отдельного get_user_ton_wallets. В user.ton_wallets попадают только активные кошельки
+        """
+        async with self.db_manager.session_scope(session) as session:
+            return await session.scalar(self._get_user_with_wallets_stmt, {"uid": user_id})
+
+    @_db_op("Ошибка при получении пользователей из БД", lambda e: {})
+    @retry_on_disconnect
+    async def get_users(self, user_ids: Sequence[int]) -> Dict[int, User]:
+        """Получение нескольких пользователей одним запросом: {user_id: User}"""
+        if not user_ids:
+            return {}
+        async with self.async_session() as session:
+            stmt = select(User).where(User.user_id.in_(set(user_ids)))
+            result = await session.execute(stmt)
+            return {user.user_id: user for user in result.scalars()}
+
+    async def iter_users(self, options: Optional[Sequence] = None, batch_size: int = 1000) -> AsyncIterator[User]:
+        """
+        Потоковый обход всех пользователей через серверный курсор, пачками по batch_size.
+        Связи подгружаются только явно через options (например, selectinload(User.ton_wallets));
+        в DEV_MODE случайная ленивая загрузка падает с ошибкой вместо N+1 запросов
+        """
+        stmt = select(User).execution_options(yield_per=batch_size)
+        if options:
+            stmt = stmt.options(*options)
+        elif self.db_manager.dev_mode:
+            stmt = stmt.options(raiseload("*"))
+        
+        async with self.async_session() as session:
+            result = await session.stream_scalars(stmt)
+            async for user in result:
+                yield user
+
+    @_db_op("Ошибка при получении всех пользователей из БД", lambda e: [])
+    async def get_all_users(self, options: Optional[Sequence] = None) -> List[User]:
+        """Получение всех пользователей списком (для админских задач; для обхода - iter_users)"""
+        return [user async for user in self.iter_users(options)]
+
+    @_db_op("Ошибка при получении списка пользователей из БД", lambda e: [])
+    @retry_on_disconnect
+    async def get_all_user_rows(self) -> List[Tuple[int, Optional[str], int]]:
+        """
+        Все пользователи списком кортежей (user_id, username, fantics):
+        только нужные колонки, без ORM-объектов и identity map
+        """
+        stmt = select(User.user_id, User.username, User.fantics)
+        async with self.db_manager.read_engine.connect() as conn:
+            result = await conn.execute(stmt)
+            return [tuple(row) for row in result]
 
+    @_db_op("Ошибка при обновлении username пользователя", False)
     async def update_user_username(self, user_id: int, new_username: str) -> bool:
         """Обновление username пользователя"""
-        try:
-            async with self.async_session() as session:
-                stmt = select(User).where(User.user_id == user_id)
-                result = await session.execute(stmt)
-                user = result.scalar_one_or_none()
-
-                if user:
-                    user.username = new_username
-                    await session.commit()
-                    print(f"🔄 Username пользователя {user_id} обновлен")
-                    return True
-                else:
-                    print(f"❌ Пользователь {user_id} не найден")
-                    return False
-
-        except Exception as e:
-            print(f"❌ Ошибка при обновлении username пользователя: {e}")
-            return False
-
+        async with self.async_session() as session:
+            stmt = (
+                update(User)
+                .where(User.user_id == user_id)
+                .values(username=new_username)
+                .returning(User.id)
+            )
+            result = await session.execute(stmt)
+
+            if result.scalar_one_or_none() is None:
+                logger.warning("❌ Пользователь %s не найден", user_id)
+                return False
+
+            await session.commit()
+            self._user_row_cache.pop(user_id)
+            if user_id in self._known_users:
+                self._known_users[user_id] = new_username
+            logger.debug("🔄 Username пользователя %s обновлен", user_id)
+            return True
+
+    @_db_op("Ошибка при удалении пользователя", False)
     async def delete_user(self, user_id: int) -> bool:
-        """Удаление пользователя из базы данных"""
-        try:
-            async with self.async_session() as session:
-                stmt = select(User).where(User.user_id == user_id)
-                result = await session.execute(stmt)
-                user = result.scalar_one_or_none()
-
-                if user:
-                    await session.delete(user)
-                    await session.commit()
-                    print(f"🗑️ Пользователь {user_id} удален из базы")
-                    return True
-                else:
-                    print(f"❌ Пользователь {user_id} не найден")
-                    return False
-
-        except Exception as e:
-            print(f"❌ Ошибка при удалении пользователя: {e}")
-            return False
-
-    async def get_users_count(self) -> int:
-        """Получение количества пользователей"""
-        try:
-            async with self.async_session() as session:
-                stmt = select(func.count(User.id))
-                result = await session.execute(stmt)
-                return result.scalar() or 0
-        except Exception as e:
-            print(f"❌ Ошибка при подсчете пользователей: {e}")
-            return 0
+        """Удаление пользователя из базы данных (кошельки удаляются каскадом по FK)"""
+        async with self.async_session() as session:
+            self._known_users.pop(user_id, None)
+            self._user_pks.pop(user_id, None)
+            if await session.scalar(self._delete_user_stmt, {"uid": user_id}) is None:
+                logger.warning("❌ Пользователь %s не найден", user_id)
+                return False
+
+            await session.commit()
+            self._fantics_cache.pop(user_id)
+            self._user_row_cache.pop(user_id)
+            logger.debug("🗑️ Пользователь %s удален из базы", user_id)
+            return True
+
+    @_db_op("Ошибка при подсчете пользователей", 0)
+    @retry_on_disconnect
+    async def get_users_count(self, session: Optional[AsyncSession] = None, exact: bool = False) -> int:
+        """
+        Получение количества пользователей.
+        На PostgreSQL по умолчанию возвращается оценка из pg_class.reltuples (обновляется
+        VACUUM/ANALYZE) без seq scan по всей таблице, точный count(*) - только при exact=True
+        """
+        approx_sql = None if exact else self._users_count_approx_sql
+        stmt = text(approx_sql) if approx_sql else self._users_count_stmt
+        if session is not None:
+            count = await session.scalar(stmt)
+        elif self.db_manager.raw_pool is not None:
+            count = await self.db_manager.raw_pool.fetchval(approx_sql or "SELECT count(*) FROM users")
+        else:
+            # Чтение без ORM-сессии и без транзакции (AUTOCOMMIT)
+            async with self.db_manager.read_engine.connect() as conn:
+                count = await conn.scalar(stmt)
+        if approx_sql and (count is None or count <= 0):
+            # Таблица еще не анализировалась (reltuples = -1, до PostgreSQL 14 - 0) - считаем точно
+            return await self.get_users_count(session, exact=True)
+        return count or 0
 
     # ========== МЕТОДЫ ДЛЯ РАБОТЫ С ФАНТИКАМИ ==========
 
-    async def get_fantics(self, user_id: int) -> Optional[int]:
-        """Получить количество фантиков пользователя"""
-        try:
-            async with self.async_session() as session:
-                stmt = select(User.fantics).where(User.user_id == user_id)
-                result = await session.execute(stmt)
-                fantics = result.scalar_one_or_none()
-                return fantics if fantics is not None else 0
-        except Exception as e:
-            print(f"❌ Ошибка при получении фантиков: {e}")
-            return None
-
+    @_db_op("Ошибка при получении фантиков")
+    @retry_on_disconnect
+    async def get_fantics(self, user_id: int, session: Optional[AsyncSession] = None) -> Optional[int]:
+        """Получить количество фантиков пользователя (с коротким кэшем)"""
+        cached = self._fantics_cache.get(user_id)
+        if cached is not None:
+            return cached
+        
+        token = self._fantics_cache.token()
+        params = {"uid": user_id}
+        raw_pool = self.db_manager.raw_pool
+        if session is not None:
+            fantics = await session.scalar(self._get_fantics_stmt, params) or 0
+        elif raw_pool is not None:
+            # Горячий путь: один запрос через asyncpg без накладных расходов SQLAlchemy
+            fantics = await raw_pool.fetchval("SELECT fantics FROM users WHERE user_id = $1", user_id) or 0
+        else:
+            async with self.db_manager.read_engine.connect() as conn:
+                fantics = await conn.scalar(self._get_fantics_stmt, params) or 0
+        self._fantics_cache.fill(user_id, fantics, token)
+        return fantics
+
+    @_db_op("Ошибка при получении фантиков", lambda e: {})
+    @retry_on_disconnect
+    async def get_fantics_many(self, user_ids: Sequence[int]) -> Dict[int, int]:
+        """Балансы нескольких пользователей одним запросом: {user_id: fantics}"""
+        if not user_ids:
+            return {}
+        stmt = select(User.user_id, User.fantics).where(User.user_id.in_(set(user_ids)))
+        async with self.db_manager.read_engine.connect() as conn:
+            result = await conn.execute(stmt)
+            return {user_id: fantics for user_id, fantics in result}
+
+    @_db_op("Ошибка при добавлении фантиков", False)
     async def add_fantics(self, user_id: int, amount: int) -> bool:
         """Добавить фантики пользователю"""
-        try:
-            async with self.async_session() as session:
-                stmt = select(User).where(User.user_id == user_id)
-                result = await session.execute(stmt)
-                user = result.scalar_one_or_none()
-
-                if user:
-                    user.fantics += amount
-                    await session.commit()
-                    print(f"➕ Добавлено {amount} фантиков пользователю {user_id} (итого: {user.fantics})")
-                    return True
-                else:
-                    print(f"❌ Пользователь {user_id} не найден")
-                    return False
-        except Exception as e:
-            print(f"❌ Ошибка при добавлении фантиков: {e}")
-            return False
+        async with self.async_session() as session:
+            result = await session.execute(self._add_fantics_stmt, {"uid": user_id, "amount": amount})
+            new_balance = result.scalar_one_or_none()
+
+            if new_balance is None:
+                logger.warning("❌ Пользователь %s не найден", user_id)
+                return False
 
+            await session.commit()
+            self._balance_changed(user_id, new_balance)
+            logger.debug("➕ Добавлено %s фантиков пользователю %s (итого: %s)", amount, user_id, new_balance)
+            return True
+
+    @_db_op("Ошибка при списании фантиков", False)
     async def subtract_fantics(self, user_id: int, amount: int) -> bool:
         """Списать фантики у пользователя"""
-        try:
-            async with self.async_session() as session:
-                stmt = select(User).where(User.user_id == user_id)
-                result = await session.execute(stmt)
-                user = result.scalar_one_or_none()
-
-                if user and user.fantics >= amount:
-                    user.fantics -= amount
-                    await session.commit()
-                    print(f"➖ Списано {amount} фантиков у пользователя {user_id} (осталось: {user.fantics})")
-                    return True
+        async with self.async_session() as session:
+            result = await session.execute(self._subtract_fantics_stmt, {"uid": user_id, "amount": amount})
+            new_balance = result.scalar_one_or_none()
+
+            if new_balance is None:
+                # Неуспешный путь: уточняем причину отдельным запросом
+                current = await self._current_balance(session, user_id)
+                if current is not None:
+                    logger.warning("❌ Недостаточно фантиков у пользователя %s: есть %s, нужно %s", user_id, current, amount)
                 else:
-                    if user:
-                        print(f"❌ Недостаточно фантиков у пользователя {user_id}: есть {user.fantics}, нужно {amount}")
-                    else:
-                        print(f"❌ Пользователь {user_id} не найден")
-                    return False
-        except Exception as e:
-            print(f"❌ Ошибка при списании фантиков: {e}")
-            return False
+                    logger.warning("❌ Пользователь %s не найден", user_id)
+                return False
 
+            await session.commit()
+            self._balance_changed(user_id, new_balance)
+            logger.debug("➖ Списано %s фантиков у пользователя %s (осталось: %s)", amount, user_id, new_balance)
+            return True
+
+    @_db_op("Ошибка при установке фантиков", False)
     async def set_fantics(self, user_id: int, amount: int) -> bool:
         """Установить точное количество фантиков пользователю"""
-        try:
-            async with self.async_session() as session:
-                stmt = select(User).where(User.user_id == user_id)
-                result = await session.execute(stmt)
-                user = result.scalar_one_or_none()
-
-                if user:
-                    user.fantics = max(0, amount)  # Не позволяем отрицательные значения
-                    await session.commit()
-                    print(f"🔄 Установлено {amount} фантиков пользователю {user_id}")
-                    return True
-                else:
-                    print(f"❌ Пользователь {user_id} не найден")
-                    return False
-        except Exception as e:
-            print(f"❌ Ошибка при установке фантиков: {e}")
-            return False
+        async with self.async_session() as session:
+            # Не позволяем отрицательные значения
+            new_balance = await session.scalar(self._set_fantics_stmt, {"uid": user_id, "amount": max(0, amount)})
+
+            if new_balance is None:
+                logger.warning("❌ Пользователь %s не найден", user_id)
+                return False
+
+            await session.commit()
+            self._balance_changed(user_id, new_balance)
+            logger.debug("🔄 Установлено %s фантиков пользователю %s", new_balance, user_id)
+            return True
+
+    def _balance_changed(self, user_id: int, new_balance: int):
+        """После коммита записи баланса: новое значение в кэш балансов, строка пользователя - из кэша"""
+        self._fantics_cache.set(user_id, new_balance)
+        self._user_row_cache.pop(user_id)
 
     # ========== АТОМАРНЫЕ ОПЕРАЦИИ ДЛЯ БЕЗОПАСНОСТИ ==========
 
+    async def _current_balance(self, session, user_id: int) -> Optional[int]:
+        """Баланс после неуспешного условного UPDATE: None - пользователя нет"""
+        return await session.scalar(self._get_fantics_stmt, {"uid": user_id})
+
+    @_db_op("Ошибка в атомарной транзакции кейса", lambda e: (False, f"Ошибка транзакции: {e}", 0))
     async def atomic_case_transaction(self, user_id: int, case_cost: int, prize_amount: int) -> Tuple[bool, str, int]:
         """
-        Атомарная транзакция для открытия кейса:
-        1. Проверяет существование пользователя
-        2. Проверяет баланс
-        3. Списывает стоимость кейса
-        4. Добавляет выигрыш
+        Атомарная транзакция для открытия кейса одним UPDATE:
+        списание стоимости и начисление выигрыша выполняются только при достаточном балансе,
+        проверку делает сама БД в условии WHERE
         
         Возвращает: (успех, сообщение, новый_баланс)
         """
-        try:
-            async with self.async_session() as session:
-                # Начинаем транзакцию с блокировкой строки пользователя
-                stmt = select(User).where(User.user_id == user_id).with_for_update()
-                result = await session.execute(stmt)
-                user = result.scalar_one_or_none()
-
-                if not user:
+        async with self.async_session() as session:
+            result = await session.execute(
+                self._case_transaction_stmt,
+                {"uid": user_id, "cost": case_cost, "prize": prize_amount}
+            )
+            new_balance = result.scalar_one_or_none()
+
+            if new_balance is None:
+                current = await self._current_balance(session, user_id)
+                if current is None:
                     return False, "Пользователь не найден в системе", 0
+                return False, f"Недостаточно фантиков. Требуется: {case_cost}, доступно: {current}", current
 
-                # Проверяем достаточность средств
-                if user.fantics < case_cost:
-                    return False, f"Недостаточно фантиков. Требуется: {case_cost}, доступно: {user.fantics}", user.fantics
-
-                # Выполняем атомарную операцию
-                old_balance = user.fantics
-                user.fantics = user.fantics - case_cost + prize_amount
-                new_balance = user.fantics
-
-                # Фиксируем транзакцию
-                await session.commit()
-                
-                print(f"💎 Атомарная транзакция кейса: пользователь {user_id}, баланс {old_balance} -> {new_balance}")
-                return True, f"Кейс открыт! Потрачено: {case_cost}, выиграно: {prize_amount}", new_balance
-
-        except Exception as e:
-            print(f"❌ Ошибка в атомарной транзакции кейса: {e}")
-            return False, f"Ошибка транзакции: {str(e)}", 0
+            await session.commit()
+            self._balance_changed(user_id, new_balance)
+            
+            logger.debug("💎 Атомарная транзакция кейса: пользователь %s, баланс %s -> %s", user_id, new_balance + case_cost - prize_amount, new_balance)
+            return True, f"Кейс открыт! Потрачено: {case_cost}, выиграно: {prize_amount}", new_balance
 
+    @_db_op("Ошибка в атомарном списании", lambda e: (False, f"Ошибка списания: {e}", 0))
     async def atomic_subtract_fantics(self, user_id: int, amount: int) -> Tuple[bool, str, int]:
         """
-        Атомарное списание фантиков с проверкой баланса
+        Атомарное списание фантиков с проверкой баланса (одним UPDATE)
         
         Возвращает: (успех, сообщение, новый_баланс)
         """
-        try:
-            async with self.async_session() as session:
-                # Блокируем строку пользователя для чтения и изменения
-                stmt = select(User).where(User.user_id == user_id).with_for_update()
-                result = await session.execute(stmt)
-                user = result.scalar_one_or_none()
+        async with self.async_session() as session:
+            result = await session.execute(self._subtract_fantics_stmt, {"uid": user_id, "amount": amount})
+            new_balance = result.scalar_one_or_none()
 
-                if not user:
+            if new_balance is None:
+                current = await self._current_balance(session, user_id)
+                if current is None:
                     return False, "Пользователь не найден", 0
-
-                # Проверяем достаточность средств
-                if user.fantics < amount:
-                    return False, f"Недостаточно фантиков. Требуется: {amount}, доступно: {user.fantics}", user.fantics
-
-                # Списываем средства
-                old_balance = user.fantics
-                user.fantics -= amount
-                new_balance = user.fantics
-
-                await session.commit()
-                
-                print(f"➖ Атомарное списание: пользователь {user_id}, {old_balance} -> {new_balance}")
-                return True, f"Списано {amount} фантиков", new_balance
-
-        except Exception as e:
-            print(f"❌ Ошибка в атомарном списании: {e}")
-            return False, f"Ошибка списания: {str(e)}", 0
-
-    async def atomic_add_fantics(self, user_id: int, amount: int) -> Tuple[bool, str, int]:
+                return False, f"Недостаточно фантиков. Требуется: {amount}, доступно: {current}", current
+
+            await session.commit()
+            self._balance_changed(user_id, new_balance)
+            
+            logger.debug("➖ Атомарное списание: пользователь %s, %s -> %s", user_id, new_balance + amount, new_balance)
+            return True, f"Списано {amount} фантиков", new_balance
+
+    @_db_op("Ошибка в атомарном добавлении", lambda e: (False, f"Ошибка добавления: {e}", 0))
+    async def atomic_add_fantics(
+        self, user_id: int, amount: int, session: Optional[AsyncSession] = None
+    ) -> Tuple[bool, str, int]:
         """
-        Атомарное добавление фантиков
+        Атомарное добавление фантиков (одним UPDATE)
+        С внешней сессией (unit_of_work) коммит и обновление кэша - после коммита владельца
         
         Возвращает: (успех, сообщение, новый_баланс)
         """
-        try:
-            async with self.async_session() as session:
-                # Блокируем строку пользователя
-                stmt = select(User).where(User.user_id == user_id).with_for_update()
-                result = await session.execute(stmt)
-                user = result.scalar_one_or_none()
-
-                if not user:
-                    return False, "Пользователь не найден в системе", 0
+        async with self.db_manager.unit_of_work(session) as session:
+            result = await session.execute(self._add_fantics_stmt, {"uid": user_id, "amount": amount})
+            new_balance = result.scalar_one_or_none()
 
-                # Добавляем средства
-                old_balance = user.fantics
-                user.fantics += amount
-                new_balance = user.fantics
+            if new_balance is None:
+                return False, "Пользователь не найден в системе", 0
 
-                await session.commit()
-                
-                print(f"➕ Атомарное добавление: пользователь {user_id}, {old_balance} -> {new_balance}")
-                return True, f"Добавлено {amount} фантиков", new_balance
-
-        except Exception as e:
-            print(f"❌ Ошибка в атомарном добавлении: {e}")
-            return False, f"Ошибка добавления: {str(e)}", 0 
\ No newline at end of file
+            self.db_manager.after_commit(session, lambda: self._balance_changed(user_id, new_balance))
+            
+            logger.debug("➕ Атомарное добавление: пользователь %s, %s -> %s", user_id, new_balance - amount, new_balance)
+            return True, f"Добавлено {amount} фантиков", new_balance
\ No newline at end of file
@@ -7,10 +7,22 @@ This module provides WalletManager class for:
 - Wallet verification and management
 """
 
-from sqlalchemy import select
-from typing import Optional, List
+import logging
+from sqlalchemy import select, update, exists, bindparam, Row
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from typing import Optional, List, Dict, Sequence, Any
 from .models import TonWallet, User
-from .manager import DatabaseManager
+from .manager import DatabaseManager, DB_INSERT_PAGE_SIZE
+from .cache import TTLCache
+
+
+logger = logging.getLogger(__name__)
+
+# Кэш списков активных кошельков по user_id, сбрасывается при каждом изменении привязок
+WALLETS_CACHE_SIZE = 50_000
+WALLETS_CACHE_TTL = 60
 
 
 class WalletManager:
@@ -19,14 +31,91 @@ class WalletManager:
     def __init__(self, db_manager: DatabaseManager):
         self.db_manager = db_manager
         self.async_session = db_manager.async_session
+        self._wallets_cache = TTLCache(WALLETS_CACHE_SIZE, WALLETS_CACHE_TTL)
+        self._build_statements(db_manager.engine.dialect.name)
+
+    def _build_statements(self, dialect_name: str):
+        """Подготовка выражений один раз при создании менеджера, параметры - через bindparam"""
+        insert = pg_insert if dialect_name == "postgresql" else sqlite_insert
+        # Уже привязанные адреса пропускаются; RETURNING включает insertmanyvalues
+        self._insert_wallets_batch_stmt = insert(TonWallet).on_conflict_do_nothing().returning(TonWallet.id)
+        
+        # Привязка одного кошелька одним запросом: INSERT ... SELECT вставляет строку,
+        # только если пользователь существует, а занятый адрес (активный у кого-либо
+        # или ранее отключенный у этого же пользователя) отсекает ON CONFLICT
+        source = select(
+            bindparam("uid", type_=TonWallet.user_id.type),
+            bindparam("address", type_=TonWallet.wallet_address.type),
+            bindparam("network", type_=TonWallet.network.type),
+            bindparam("public_key", type_=TonWallet.public_key.type),
+        ).where(exists().where(User.user_id == bindparam("uid")))
+        # Core-таблица, а не ORM-сущность: иначе словарь параметров ORM примет за bulk-вставку
+        wallets = TonWallet.__table__
+        self._add_wallet_stmt = (
+            insert(wallets)
+            .from_select(["user_id", "wallet_address", "network", "public_key"], source)
+            .on_conflict_do_nothing()
+            .returning(wallets.c.id)
+        )
+        self._wallet_owner_stmt = select(TonWallet.user_id).where(
+            (TonWallet.wallet_address == bindparam("address")) & (TonWallet.is_active == True)
+        )
+        # Повторная привязка своего ранее отключенного кошелька
+        self._reactivate_own_wallet_stmt = (
+            update(wallets)
+            .where(
+                wallets.c.user_id == bindparam("uid"),
+                wallets.c.wallet_address == bindparam("address"),
+                wallets.c.is_active == False
+            )
+            .values(is_active=True, network=bindparam("network"), public_key=bindparam("public_key"))
+            .returning(wallets.c.id)
+        )
+        
+        address_is_active = (TonWallet.wallet_address == bindparam("address")) & (TonWallet.is_active == True)
+        self._user_wallets_stmt = select(TonWallet).where(
+            (TonWallet.user_id == bindparam("uid")) & (TonWallet.is_active == True)
+        )
+        self._user_wallet_rows_stmt = select(
+            TonWallet.id,
+            TonWallet.wallet_address,
+            TonWallet.network,
+            TonWallet.created_at,
+            TonWallet.is_active
+        ).where(
+            (TonWallet.user_id == bindparam("uid")) & (TonWallet.is_active == True)
+        )
+        self._user_wallet_addresses_stmt = select(TonWallet.wallet_address).where(
+            (TonWallet.user_id == bindparam("uid")) & (TonWallet.is_active == True)
+        )
+        self._active_wallet_stmt = select(TonWallet).where(address_is_active)
+        self._deactivate_wallet_stmt = (
+            update(wallets)
+            .where((wallets.c.wallet_address == bindparam("address")) & (wallets.c.is_active == True))
+            .values(is_active=False)
+            .returning(wallets.c.user_id)
+        )
+        last_inactive_id = (
+            select(wallets.c.id)
+            .where((wallets.c.wallet_address == bindparam("address")) & (wallets.c.is_active == False))
+            .order_by(wallets.c.id.desc())
+            .limit(1)
+            .scalar_subquery()
+        )
+        self._reactivate_wallet_stmt = (
+            update(wallets)
+            .where(wallets.c.id == last_inactive_id)
+            .values(is_active=True)
+            .returning(wallets.c.user_id)
+        )
+        self._wallet_is_active_stmt = select(exists().where(address_is_active))
 
     async def add_ton_wallet(
         self, 
         user_id: int, 
         wallet_address: str, 
         network: Optional[str] = None, 
-        public_key: Optional[str] = None, 
-        retry_count: int = 0
+        public_key: Optional[str] = None
     ) -> bool:
         """
         Добавление TON кошелька для пользователя
@@ -34,60 +123,114 @@ class WalletManager:
         :param wallet_address: Адрес кошелька в сети TON
         :param network: Сеть кошелька (например, "-239")
         :param public_key: Публичный ключ кошелька в hex формате
-        :param retry_count: Счетчик повторных попыток (для предотвращения рекурсии)
         :return: True если успешно, False если ошибка
         """
         try:
             async with self.async_session() as session:
-                # Проверяем существование пользователя
-                user_stmt = select(User).where(User.user_id == user_id)
-                user_result = await session.execute(user_stmt)
-                user = user_result.scalar_one_or_none()
+                params = {
+                    "uid": user_id,
+                    "address": wallet_address,
+                    "network": network,
+                    "public_key": public_key,
+                }
+                result = await session.execute(self._add_wallet_stmt, params)
+                wallet_id = result.scalar_one_or_none()
                 
-                if not user:
-                    print(f"❌ Пользователь {user_id} не найден")
-                    return False
-                
-                # Проверяем, не привязан ли уже этот кошелек
-                wallet_stmt = select(TonWallet).where(
-                    (TonWallet.wallet_address == wallet_address)
-                )
-                wallet_result = await session.execute(wallet_stmt)
-                existing_wallet = wallet_result.scalar_one_or_none()
-                
-                if existing_wallet:
-                    print(f"⚠️ Кошелек {wallet_address} уже привязан к пользователю {existing_wallet.user_id}")
-                    return False
+                if wallet_id is None:
+                    # Холодный путь: выясняем, почему вставка не прошла
+                    owner_id = await session.scalar(self._wallet_owner_stmt, params)
+                    if owner_id is not None:
+                        logger.warning("⚠️ Кошелек %s уже привязан к пользователю %s", wallet_address, owner_id)
+                        return False
+                    wallet_id = await session.scalar(self._reactivate_own_wallet_stmt, params)
+                    if wallet_id is None:
+                        logger.warning("❌ Пользователь %s не найден", user_id)
+                        return False
                 
-                # Создаем новый кошелек
-                new_wallet = TonWallet(
-                    user_id=user_id,
-                    wallet_address=wallet_address,
-                    network=network,
-                    public_key=public_key
-                )
-                
-                session.add(new_wallet)
                 await session.commit()
-                print(f"➕ Кошелек {wallet_address} успешно привязан к пользователю {user_id}")
+                self._wallets_cache.pop(user_id)
+                logger.info("➕ Кошелек %s успешно привязан к пользователю %s", wallet_address, user_id)
                 return True
                 
         except Exception as e:
-            print(f"❌ Ошибка при добавлении TON кошелька: {e}")
-            
-            # Проверяем, является ли это ошибкой кэша и не превышен ли лимит повторных попыток
-            if ("InvalidCachedStatementError" in str(e) or "cached statement plan is invalid" in str(e)) and retry_count < 1:
-                print("🔄 Обнаружена ошибка кэша SQLAlchemy, очищаем кэш...")
-                try:
-                    await self.db_manager.clear_cache_and_reconnect()
-                    # Повторяем попытку после очистки кэша
-                    return await self.add_ton_wallet(user_id, wallet_address, network, public_key, retry_count + 1)
-                except Exception as retry_error:
-                    print(f"❌ Ошибка при повторной попытке: {retry_error}")
-                    return False
-            
+            logger.exception("❌ Ошибка при добавлении TON кошелька: %s", e)
             return False
 
+    async def add_ton_wallets_batch(self, rows: Sequence[Dict[str, Any]]) -> int:
+        """
+        Пакетная привязка TON кошельков
+        :param rows: Словари с ключами user_id, wallet_address и необязательными network, public_key
+        :return: Количество реально добавленных кошельков (0 при ошибке)
+        """
+        if not rows:
+            return 0
+        try:
+            async with self.async_session() as session:
+                # Владельцев проверяем одним запросом, строки с несуществующими пользователями отбрасываем
+                user_ids = {row["user_id"] for row in rows}
+                existing = set((await session.execute(
+                    select(User.user_id).where(User.user_id.in_(user_ids))
+                )).scalars())
+                params = [
+                    {
+                        "user_id": row["user_id"],
+                        "wallet_address": row["wallet_address"],
+                        "network": row.get("network"),
+                        "public_key": row.get("public_key"),
+                    }
+                    for row in rows if row["user_id"] in existing
+                ]
+                
+                inserted = 0
+                for start in range(0, len(params), DB_INSERT_PAGE_SIZE):
+                    result = await session.execute(
+                        self._insert_wallets_batch_stmt, params[start:start + DB_INSERT_PAGE_SIZE]
+                    )
+                    inserted += len(result.scalars().all())
+                await session.commit()
+                self._wallets_cache.clear()
+                
+                logger.info("➕ Пакетно привязано кошельков: %s из %s", inserted, len(rows))
+                return inserted
+        except Exception as e:
+            logger.exception("❌ Ошибка при пакетном добавлении TON кошельков: %s", e)
+            return 0
+
+    async def get_user_ton_wallet_rows(self, user_id: int) -> List[Row]:
+        """
+        Активные TON кошельки пользователя для чтения: строки
+        (id, wallet_address, network, created_at, is_active) без ORM-объектов, с кэшем на минуту
+        :param user_id: ID пользователя в Telegram
+        :return: Список строк или пустой список
+        """
+        cached = self._wallets_cache.get(user_id)
+        if cached is not None:
+            return list(cached)
+        try:
+            token = self._wallets_cache.token()
+            async with self.db_manager.read_engine.connect() as conn:
+                result = await conn.execute(self._user_wallet_rows_stmt, {"uid": user_id})
+                rows = tuple(result)
+            self._wallets_cache.fill(user_id, rows, token)
+            return list(rows)
+        except Exception as e:
+            logger.exception("❌ Ошибка при получении TON кошельков: %s", e)
+            return []
+
+    async def get_user_active_wallet_addresses(self, user_id: int) -> List[str]:
+        """
+        Адреса активных TON кошельков пользователя (только одна колонка)
+        :param user_id: ID пользователя в Telegram
+        :return: Список адресов или пустой список
+        """
+        try:
+            async with self.db_manager.read_engine.connect() as conn:
+                result = await conn.scalars(self._user_wallet_addresses_stmt, {"uid": user_id})
+                return list(result)
+        except Exception as e:
+            logger.exception("❌ Ошибка при получении адресов TON кошельков: %s", e)
+            return []
+
     async def get_user_ton_wallets(self, user_id: int) -> List[TonWallet]:
         """
         Получение всех TON кошельков пользователя
@@ -95,98 +238,73 @@ class WalletManager:
         :return: Список кошельков или пустой список
         """
         try:
-            async with self.async_session() as session:
-                stmt = select(TonWallet).where(
-                    (TonWallet.user_id == user_id) &
-                    (TonWallet.is_active == True)
-                )
-                result = await session.execute(stmt)
-                return list(result.scalars().all())
+            async with self.db_manager.session_scope() as session:
+                result = await session.scalars(self._user_wallets_stmt, {"uid": user_id})
+                return list(result.all())
         except Exception as e:
-            print(f"❌ Ошибка при получении TON кошельков: {e}")
+            logger.exception("❌ Ошибка при получении TON кошельков: %s", e)
             return []
 
-    async def get_ton_wallet_by_address(self, wallet_address: str, retry_count: int = 0) -> Optional[TonWallet]:
+    async def get_ton_wallet_by_address(self, wallet_address: str) -> Optional[TonWallet]:
         """
-        Получение кошелька по адресу
+        Получение активного кошелька по адресу
         :param wallet_address: Адрес кошелька в сети TON
-        :param retry_count: Счетчик повторных попыток (для предотвращения рекурсии)
         :return: Объект TonWallet или None
         """
         try:
-            async with self.async_session() as session:
-                stmt = select(TonWallet).where(
-                    (TonWallet.wallet_address == wallet_address)
-                )
-                result = await session.execute(stmt)
-                return result.scalar_one_or_none()
+            async with self.db_manager.session_scope() as session:
+                return await session.scalar(self._active_wallet_stmt, {"address": wallet_address})
         except Exception as e:
-            print(f"❌ Ошибка при получении TON кошелька: {e}")
-            
-            # Проверяем, является ли это ошибкой кэша и не превышен ли лимит повторных попыток
-            if ("InvalidCachedStatementError" in str(e) or "cached statement plan is invalid" in str(e)) and retry_count < 1:
-                print("🔄 Обнаружена ошибка кэша SQLAlchemy, очищаем кэш...")
-                try:
-                    await self.db_manager.clear_cache_and_reconnect()
-                    # Повторяем попытку после очистки кэша
-                    return await self.get_ton_wallet_by_address(wallet_address, retry_count + 1)
-                except Exception as retry_error:
-                    print(f"❌ Ошибка при повторной попытке: {retry_error}")
-                    return None
-            
+            logger.exception("❌ Ошибка при получении TON кошелька: %s", e)
             return None
 
-    async def deactivate_ton_wallet(self, wallet_address: str) -> bool:
+    async def set_wallet_active(self, wallet_address: str, active: bool) -> bool:
         """
-        Деактивация TON кошелька (мягкое удаление)
+        Включение/отключение TON кошелька одним UPDATE.
+        Отключается активная привязка адреса, включается последняя отключенная;
+        включение не пройдет, если адрес уже активен у другого пользователя
         :param wallet_address: Адрес кошелька в сети TON
-        :return: True если успешно, False если ошибка
+        :param active: Новое состояние кошелька
+        :return: True если успешно, False если кошелек не найден или ошибка
         """
+        stmt = self._reactivate_wallet_stmt if active else self._deactivate_wallet_stmt
         try:
             async with self.async_session() as session:
-                stmt = select(TonWallet).where(
-                    (TonWallet.wallet_address == wallet_address)
-                )
-                result = await session.execute(stmt)
-                wallet = result.scalar_one_or_none()
-                
-                if wallet:
-                    wallet.is_active = False
-                    await session.commit()
-                    print(f"➖ Кошелек {wallet_address} деактивирован")
-                    return True
-                else:
-                    print(f"❌ Кошелек {wallet_address} не найден")
+                owner_id = await session.scalar(stmt, {"address": wallet_address})
+                if owner_id is None:
+                    logger.warning("❌ Кошелек %s не найден", wallet_address)
                     return False
+                await session.commit()
+                self._wallets_cache.pop(owner_id)
+                if active:
+                    logger.info("🔄 Кошелек %s реактивирован", wallet_address)
+                else:
+                    logger.info("➖ Кошелек %s деактивирован", wallet_address)
+                return True
+        except IntegrityError:
+            # Ожидаемый отказ: адрес уже активен у другого пользователя (uq_ton_wallets_address_active)
+            logger.warning("⚠️ Кошелек %s уже активен у другого пользователя", wallet_address)
+            return False
         except Exception as e:
-            print(f"❌ Ошибка при деактивации TON кошелька: {e}")
+            action = "реактивации" if active else "деактивации"
+            logger.exception("❌ Ошибка при %s TON кошелька: %s", action, e)
             return False
 
+    async def deactivate_ton_wallet(self, wallet_address: str) -> bool:
+        """
+        Деактивация TON кошелька (мягкое удаление)
+        :param wallet_address: Адрес кошелька в сети TON
+        :return: True если успешно, False если ошибка
+        """
+        return await self.set_wallet_active(wallet_address, False)
+
     async def reactivate_ton_wallet(self, wallet_address: str) -> bool:
         """
         Повторная активация TON кошелька
         :param wallet_address: Адрес кошелька в сети TON
         :return: True если успешно, False если ошибка
         """
-        try:
-            async with self.async_session() as session:
-                stmt = select(TonWallet).where(
-                    (TonWallet.wallet_address == wallet_address)
-                )
-                result = await session.execute(stmt)
-                wallet = result.scalar_one_or_none()
-                
-                if wallet:
-                    wallet.is_active = True
-                    await session.commit()
-                    print(f"🔄 Кошелек {wallet_address} реактивирован")
-                    return True
-                else:
-                    print(f"❌ Кошелек {wallet_address} не найден")
-                    return False
-        except Exception as e:
-            print(f"❌ Ошибка при реактивации TON кошелька: {e}")
-            return False
+        return await self.set_wallet_active(wallet_address, True)
 
     async def get_wallet_owner(self, wallet_address: str) -> Optional[int]:
         """
@@ -195,15 +313,10 @@ class WalletManager:
         :return: ID пользователя или None
         """
         try:
-            async with self.async_session() as session:
-                stmt = select(TonWallet.user_id).where(
-                    (TonWallet.wallet_address == wallet_address) &
-                    (TonWallet.is_active == True)
-                )
-                result = await session.execute(stmt)
-                return result.scalar_one_or_none()
+            async with self.db_manager.read_engine.connect() as conn:
+                return await conn.scalar(self._wallet_owner_stmt, {"address": wallet_address})
         except Exception as e:
-            print(f"❌ Ошибка при получении владельца кошелька: {e}")
+            logger.exception("❌ Ошибка при получении владельца кошелька: %s", e)
             return None
 
     async def is_wallet_active(self, wallet_address: str) -> bool:
@@ -213,13 +326,8 @@ class WalletManager:
         :return: True если кошелек активен, False в противном случае
         """
         try:
-            async with self.async_session() as session:
-                stmt = select(TonWallet.is_active).where(
-                    TonWallet.wallet_address == wallet_address
-                )
-                result = await session.execute(stmt)
-                is_active = result.scalar_one_or_none()
-                return is_active is True
+            async with self.db_manager.read_engine.connect() as conn:
+                return await conn.scalar(self._wallet_is_active_stmt, {"address": wallet_address}) is True
         except Exception as e:
-            print(f"❌ Ошибка при проверке активности кошелька: {e}")
+            logger.exception("❌ Ошибка при проверке активности кошелька: %s", e)
             return False 
\ No newline at end of file
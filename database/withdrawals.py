@@ -9,10 +9,10 @@ This module provides WithdrawalManager class for:
 """
 
 import asyncio
+import logging
 import sys
 import os
 from sqlalchemy import select, func
-from datetime import datetime
 from typing import Optional, List, Dict, Any
 from .models import WithdrawalRequest
 from .manager import DatabaseManager
@@ -22,6 +22,9 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from ton_keeper_manager import tonkeeper_manager
 
 
+logger = logging.getLogger(__name__)
+
+
 class WithdrawalManager:
     """Менеджер для работы с запросами на вывод средств"""
     
@@ -44,7 +47,7 @@ class WithdrawalManager:
         try:
             # Валидация TON адреса через TonKeeper
             if not self.tonkeeper.validate_ton_address(destination_address):
-                print(f"❌ Неверный TON адрес: {destination_address}")
+                logger.warning("❌ Неверный TON адрес: %s", destination_address)
                 return False
             
             async with self.async_session() as session:
@@ -59,11 +62,11 @@ class WithdrawalManager:
                 session.add(withdrawal)
                 await session.commit()
                 
-                print(f"✅ Запрос на вывод создан: {amount_ton} TON -> {destination_address}")
+                logger.info("✅ Запрос на вывод создан: %s TON -> %s", amount_ton, destination_address)
                 return True
                 
         except Exception as e:
-            print(f"❌ Ошибка создания запроса на вывод: {e}")
+            logger.exception("❌ Ошибка создания запроса на вывод: %s", e)
             return False
     
     async def create_withdrawal_qr(
@@ -76,11 +79,11 @@ class WithdrawalManager:
             # Получаем данные о выводе
             withdrawal = await self.get_withdrawal_request(withdrawal_id)
             if not withdrawal:
-                print(f"❌ Запрос на вывод {withdrawal_id} не найден")
+                logger.warning("❌ Запрос на вывод %s не найден", withdrawal_id)
                 return None
             
             if withdrawal.status != 'pending':
-                print(f"❌ Запрос на вывод {withdrawal_id} уже обработан (статус: {withdrawal.status})")
+                logger.warning("❌ Запрос на вывод %s уже обработан (статус: %s)", withdrawal_id, withdrawal.status)
                 return None
             
             # Создаем QR-код через TonKeeper
@@ -92,14 +95,14 @@ class WithdrawalManager:
             )
             
             if qr_result["success"]:
-                print(f"✅ QR-код для вывода {withdrawal_id} создан успешно")
+                logger.info("✅ QR-код для вывода %s создан успешно", withdrawal_id)
                 return qr_result
             else:
-                print(f"❌ Ошибка создания QR-кода: {qr_result['error']}")
+                logger.warning("❌ Ошибка создания QR-кода: %s", qr_result['error'])
                 return None
                 
         except Exception as e:
-            print(f"❌ Ошибка создания QR-кода: {e}")
+            logger.exception("❌ Ошибка создания QR-кода: %s", e)
             return None
     
     async def get_withdrawal_instructions(
@@ -123,7 +126,7 @@ class WithdrawalManager:
             return summary
             
         except Exception as e:
-            print(f"❌ Ошибка получения инструкций: {e}")
+            logger.exception("❌ Ошибка получения инструкций: %s", e)
             return None
     
     async def get_withdrawal_request(self, request_id: int) -> Optional[WithdrawalRequest]:
@@ -135,7 +138,7 @@ class WithdrawalManager:
                 return result.scalar_one_or_none()
                 
         except Exception as e:
-            print(f"❌ Ошибка получения запроса на вывод: {e}")
+            logger.exception("❌ Ошибка получения запроса на вывод: %s", e)
             return None
     
     async def get_user_withdrawal_requests(
@@ -154,9 +157,27 @@ class WithdrawalManager:
                 return result.scalars().all()
                 
         except Exception as e:
-            print(f"❌ Ошибка получения истории выводов: {e}")
+            logger.exception("❌ Ошибка получения истории выводов: %s", e)
             return []
     
+    async def get_user_withdrawn_today(self, user_id: int) -> int:
+        """
+        Сумма фантиков в выводах пользователя (pending и completed) за текущие сутки.
+        Границу суток считает БД (CURRENT_DATE) - по тем же часам, что ставят created_at
+        """
+        try:
+            async with self.async_session() as session:
+                stmt = select(func.coalesce(func.sum(WithdrawalRequest.amount_fantics), 0)).where(
+                    WithdrawalRequest.user_id == user_id,
+                    WithdrawalRequest.status.in_(['pending', 'completed']),
+                    WithdrawalRequest.created_at >= func.current_date()
+                )
+                return await session.scalar(stmt)
+                
+        except Exception as e:
+            logger.exception("❌ Ошибка подсчета выводов за сутки: %s", e)
+            raise
+    
     async def get_pending_withdrawals(self, limit: int = 50) -> List[WithdrawalRequest]:
         """Получение всех ожидающих обработки запросов на вывод"""
         try:
@@ -169,7 +190,7 @@ class WithdrawalManager:
                 return result.scalars().all()
                 
         except Exception as e:
-            print(f"❌ Ошибка получения ожидающих выводов: {e}")
+            logger.exception("❌ Ошибка получения ожидающих выводов: %s", e)
             return []
     
     async def update_withdrawal_status(
@@ -196,70 +217,37 @@ class WithdrawalManager:
                     withdrawal.error_message = error_message
                 
                 if status in ['completed', 'failed']:
-                    withdrawal.processed_at = datetime.now()
+                    withdrawal.processed_at = func.now()
                 
                 await session.commit()
                 return True
                 
         except Exception as e:
-            print(f"❌ Ошибка обновления статуса вывода: {e}")
+            logger.exception("❌ Ошибка обновления статуса вывода: %s", e)
             return False
     
     async def get_withdrawal_statistics(self) -> dict:
         """Получение статистики выводов"""
         try:
             async with self.async_session() as session:
-                # Общая статистика
-                total_withdrawals = await session.scalar(
-                    select(func.count(WithdrawalRequest.id))
-                )
+                # Вся статистика одним проходом по таблице: условные агрегаты через FILTER
+                def count_status(status: str):
+                    return func.count(WithdrawalRequest.id).filter(WithdrawalRequest.status == status)
                 
-                # Статистика по статусам
-                pending_withdrawals = await session.scalar(
-                    select(func.count(WithdrawalRequest.id)).where(
-                        WithdrawalRequest.status == 'pending'
-                    )
+                stmt = select(
+                    func.count(WithdrawalRequest.id).label("total_withdrawals"),
+                    count_status('pending').label("pending_withdrawals"),
+                    count_status('completed').label("completed_withdrawals"),
+                    count_status('failed').label("failed_withdrawals"),
+                    func.coalesce(func.sum(WithdrawalRequest.amount_fantics), 0).label("total_fantics"),
+                    func.coalesce(func.sum(WithdrawalRequest.amount_ton), 0).label("total_ton"),
+                    func.coalesce(func.sum(WithdrawalRequest.fee_amount), 0).label("total_fees"),
                 )
-                
-                completed_withdrawals = await session.scalar(
-                    select(func.count(WithdrawalRequest.id)).where(
-                        WithdrawalRequest.status == 'completed'
-                    )
-                )
-                
-                failed_withdrawals = await session.scalar(
-                    select(func.count(WithdrawalRequest.id)).where(
-                        WithdrawalRequest.status == 'failed'
-                    )
-                )
-                
-                # Общая сумма фантиков
-                total_fantics = await session.scalar(
-                    select(func.sum(WithdrawalRequest.amount_fantics))
-                ) or 0
-                
-                # Общая сумма в TON
-                total_ton = await session.scalar(
-                    select(func.sum(WithdrawalRequest.amount_ton))
-                ) or 0
-                
-                # Общая сумма комиссий
-                total_fees = await session.scalar(
-                    select(func.sum(WithdrawalRequest.fee_amount))
-                ) or 0
-                
-                return {
-                    "total_withdrawals": total_withdrawals,
-                    "pending_withdrawals": pending_withdrawals,
-                    "completed_withdrawals": completed_withdrawals,
-                    "failed_withdrawals": failed_withdrawals,
-                    "total_fantics": total_fantics,
-                    "total_ton": total_ton,
-                    "total_fees": total_fees
-                }
+                result = await session.execute(stmt)
+                return dict(result.one()._mapping)
                 
         except Exception as e:
-            print(f"❌ Ошибка получения статистики выводов: {e}")
+            logger.exception("❌ Ошибка получения статистики выводов: %s", e)
             return {
                 "total_withdrawals": 0,
                 "pending_withdrawals": 0,
@@ -7,12 +7,12 @@ import logging
 logger = logging.getLogger(__name__)
 telegram_auth = TelegramAuth(BOT_TOKEN)
 
-# Импортируем DatabaseManager для создания пользователей
-from database import DatabaseManager
+# Единственный фасад БД приложения: main.py импортирует его отсюда, поэтому аутентификация
+# работает с тем же UserManager (кэши пользователей и очередь записи username)
+from database import DatabaseFacade
 from config import DATABASE_URL
 
-# Создаем инстанс менеджера БД для аутентификации
-auth_db_manager = DatabaseManager(DATABASE_URL)
+db_manager = DatabaseFacade(DATABASE_URL, dev_mode=DEV_MODE)
 
 async def get_current_user(
     request: Request,
@@ -42,20 +42,14 @@ async def get_current_user(
         username = user_data.get('username') or user_data.get('user', {}).get('username')
         
         # СОЗДАНИЕ ПОЛЬЗОВАТЕЛЯ ПРИ ПЕРВОМ ЗАХОДЕ
+        # add_user - это upsert: создает пользователя или обновляет изменившийся username
         try:
-            existing_user = await auth_db_manager.get_user(user_id)
-            if not existing_user:
-                logger.info(f"👤 Создаем нового пользователя: ID = {user_id}, username = {username}")
-                await auth_db_manager.add_user(user_id, username)
-            else:
-                # Обновляем username если изменился
-                if username and existing_user.username != username:
-                    await auth_db_manager.add_user(user_id, username)  # add_user обновляет username
+            await db_manager.user_manager.add_user(user_id, username)
         except Exception as db_error:
-            logger.error(f"❌ Ошибка работы с БД при аутентификации: {db_error}")
+            logger.error("❌ Ошибка работы с БД при аутентификации: %s", db_error)
             # Не блокируем аутентификацию из-за ошибок БД
         
-        logger.info(f"🔐 User authenticated: ID = {user_id}")   
+        logger.debug("🔐 User authenticated: ID = %s", user_id)
         return user_data
     except Exception as e:
         raise HTTPException(status_code=401, detail=f"Invalid Telegram auth: {str(e)}")
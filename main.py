@@ -1,27 +1,43 @@
+import atexit
 import logging
 import json
+import queue
 import uvicorn
 
-from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi import FastAPI, HTTPException, Depends, Request, Response, Query
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Optional, List
+from typing import Optional, List, AsyncIterator
 from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from database import DatabaseFacade
+from database import start_statement_count
 from database import CaseManager
 from rabbit_manager import RabbitManager
 import config
-from dependencies import get_current_user, get_current_user_id
+from dependencies import get_current_user, get_current_user_id, db_manager
 from payment_manager import PaymentManager, TonWalletRequest, TonWalletResponse, FanticsTransaction, TopUpTonRequest, TopUpStarsRequest
 from withdrawal_manager import WithdrawalManager, WithdrawalRequestModel
 
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', force=True)
+# Обработчики пишут в очередь, вывод в stderr делает фоновый поток слушателя:
+# запись лога не блокирует event loop на I/O
+_log_queue = queue.SimpleQueue()
+_log_listener = QueueListener(_log_queue, logging.StreamHandler())
+_log_listener.start()
+atexit.register(_log_listener.stop)
+logging.basicConfig(
+  level=logging.INFO,
+  format='%(asctime)s - %(levelname)s - %(message)s',
+  handlers=[QueueHandler(_log_queue)],
+  force=True
+)
 for logger in ["uvicorn.access", "uvicorn.error", "fastapi", "sqlalchemy", "aio_pika", "aiormq"]:
     logging.getLogger(logger).setLevel(logging.WARNING)
 
+logger = logging.getLogger(__name__)
+
 
-db_manager = DatabaseFacade(config.DATABASE_URL)
 case_manager = db_manager.case_manager
 rabbit_manager = RabbitManager(db_manager)
 use_rabbitmq = rabbit_manager.initialize()
@@ -35,7 +51,7 @@ async def lifespan(app: FastAPI):
     
     try:
         await db_manager.init_db()
-        await case_manager.initialize()
+        db_manager.start_payment_expiry_sweep()
         print("✅ База данных инициализирована")
 
         if use_rabbitmq:
@@ -58,6 +74,7 @@ async def lifespan(app: FastAPI):
     try:
         if rabbit_manager.is_ready:
             await rabbit_manager.disconnect()
+        await db_manager.stop_payment_expiry_sweep()
         await db_manager.close()
         print("✅ API сервер остановлен")
     except Exception as e:
@@ -68,7 +85,7 @@ app = FastAPI(title="Telegram Casino API", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
   CORSMiddleware,
-  allow_origins=["*"],  # Временно
+  allow_origin_regex=config.CORS_ORIGIN_REGEX,
   allow_credentials=True,
   allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
   allow_headers=["*"],
@@ -76,23 +93,28 @@ app.add_middleware(
 )
 
 
+if config.DEV_MODE:
+  @app.middleware("http")
+  async def log_statement_count(request: Request, call_next):
+    """Количество SQL-запросов на каждый HTTP-запрос (только в режиме разработки)"""
+    counter = start_statement_count()
+    response = await call_next(request)
+    logger.info("🧮 %s %s: %d SQL-запросов", request.method, request.url.path, counter[0])
+    return response
+
+
+async def get_session() -> AsyncIterator[AsyncSession]:
+  """Одна сессия БД на запрос"""
+  async with db_manager.db_manager.request_session() as session:
+    yield session
+
+
 
 @app.get("/cases")
 async def get_cases():
   """Получить все доступные кейсы"""
-  cases = await case_manager.repository.get_all_cases()
-
-  cases_list = [{
-    "id": case.id,
-    "name": case.name,
-    "cost": case.cost,
-    "presents": [{"cost": p.cost, "probability": prob}
-                 for p, prob in case.presents_with_probabilities],
-    "created_at": case.created_at.isoformat() if case.created_at else None,
-    "updated_at": case.updated_at.isoformat() if case.updated_at else None
-  } for case in cases.values()]
-
-  return cases_list
+  content = await case_manager.repository.get_all_cases_json()
+  return Response(content=content, media_type="application/json")
 
 
 
@@ -128,6 +150,46 @@ async def open_case(case_id: int, user_id: int = Depends(get_current_user_id)):
   }
 
 
+@app.post("/open_case/{case_id}/bulk")
+async def open_cases_bulk(
+  case_id: int,
+  n: int = Query(..., ge=1, le=100),
+  user_id: int = Depends(get_current_user_id)
+):
+  """Открыть кейс несколько раз одной транзакцией"""
+  case = await case_manager.repository.get_case(case_id)
+  if not case:
+    raise HTTPException(status_code=404, detail="Нема такого кейсика")
+
+  total_cost = case.cost * n
+  gifts = [gift.cost for gift in case.get_random_presents(n)]
+  total_prize = sum(gifts)
+
+  success, message, new_balance = await db_manager.atomic_case_transaction(
+      user_id=user_id,
+      case_cost=total_cost,
+      prize_amount=total_prize
+  )
+
+  if not success:
+    raise HTTPException(status_code=400, detail=message)
+
+  logger.debug(
+    "🎰 Пользователь %s открыл кейс %s x%s: потратил %s, выиграл %s, баланс: %s",
+    user_id, case_id, n, total_cost, total_prize, new_balance
+  )
+
+  return {
+    "gifts": gifts,
+    "case_id": case_id,
+    "count": n,
+    "spent": total_cost,
+    "profit": total_prize - total_cost,
+    "new_balance": new_balance,
+    "message": message
+  }
+
+
 @app.post("/fantics/add")
 async def add_fantics(
   transaction: FanticsTransaction,
@@ -149,6 +211,7 @@ async def get_user_fantics(
       detail="Вы можете просматривать только свой баланс"
     )
 
+  # Без сессии запроса: чтение идет через пул asyncpg, без BEGIN/ROLLBACK SQLAlchemy
   fantics = await db_manager.get_fantics(user_id)
   if fantics is None:
     raise HTTPException(
@@ -213,10 +276,11 @@ async def confirm_ton_topup(
 @app.get("/payment/status/{payment_id}")
 async def get_payment_status(
     payment_id: str,
-    current_user_id: int = Depends(get_current_user_id)
+    current_user_id: int = Depends(get_current_user_id),
+    session: AsyncSession = Depends(get_session)
 ):
     """Получение статуса платежа"""
-    payment = await db_manager.get_pending_payment(payment_id)
+    payment = await db_manager.get_pending_payment(payment_id, session)
     if not payment:
         raise HTTPException(status_code=404, detail="Платеж не найден")
     
@@ -1,7 +1,7 @@
 
 
 from fastapi import HTTPException
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional, Dict, Any, List
 from datetime import datetime
 from database import DatabaseFacade
@@ -60,6 +60,8 @@ class TonWalletResponse(BaseModel):
 
 class FanticsTransaction(BaseModel):
     """Транзакция фантиков"""
+    model_config = ConfigDict(frozen=True, extra="forbid")
+    
     user_id: int
     amount: int
 
@@ -300,18 +302,23 @@ class PaymentManager:
                     detail=f"Платеж в статусе {payment.status}"
                 )
         
-        # 4. Проверяем, не истек ли платеж
-        if payment.expires_at < datetime.now():
-            await self.db.update_payment_status(payment_id, 'expired')
+        # 4. Проверяем, не истек ли платеж (по часам БД, которые ставят expires_at)
+        if await self.db.expire_payment_if_due(payment_id):
             raise HTTPException(
                 status_code=400, 
                 detail="Платеж истек"
             )
         
-        # 5. Сразу добавляем фантики (без проверки в блокчейне)
-        success, message, new_balance = await self.db.atomic_add_fantics(
-            payment.user_id, 
-            payment.amount_fantics
+        # 5. Сразу добавляем фантики (без проверки в блокчейне), записываем успешный платеж
+        #    и помечаем платеж подтвержденным - одной транзакцией
+        success, message, new_balance = await self.db.confirm_payment(
+            payment_id=payment_id,
+            user_id=payment.user_id,
+            payment_method="ton",
+            amount_fantics=payment.amount_fantics,
+            amount_paid=payment.amount_ton,
+            sender_wallet=sender_wallet,  # Используем переданный адрес кошелька
+            transaction_hash=transaction_hash
         )
         
         if not success:
@@ -321,20 +328,6 @@ class PaymentManager:
                 detail=f"Ошибка добавления фантиков: {message}"
             )
         
-        # 6. Записываем успешный платеж
-        await self.db.add_successful_payment(
-            user_id=payment.user_id,
-            payment_method="ton",
-            amount_fantics=payment.amount_fantics,
-            amount_paid=payment.amount_ton,
-            sender_wallet=sender_wallet,  # Используем переданный адрес кошелька
-            transaction_hash=transaction_hash,
-            payment_id=payment_id
-        )
-        
-        # 7. Помечаем платеж как подтвержденный
-        await self.db.update_payment_status(payment_id, 'confirmed', transaction_hash)
-        
         print(f"✅ TON пополнение подтверждено: пользователь {user_id} получил {payment.amount_fantics} фантиков, баланс: {new_balance}")
         
         return {
@@ -668,7 +661,7 @@ class PaymentManager:
                 detail="Вы можете просматривать только свои кошельки"
             )
 
-        wallets = await self.db.get_user_ton_wallets(user_id)
+        wallets = await self.db.get_user_ton_wallet_rows(user_id)
         return [self._format_wallet_response(wallet) for wallet in wallets]
 
     async def connect_ton_wallet(
@@ -7,7 +7,7 @@ import asyncio
 import logging
 import base64
 from typing import Optional, Dict, Any, List
-from datetime import datetime, timedelta
+from datetime import datetime
 from pydantic import BaseModel, Field
 from tonsdk.contract.wallet import Wallets, WalletVersionEnum
 from tonsdk.utils import Address, to_nano
@@ -139,17 +139,8 @@ class WithdrawalManager:
     async def _check_daily_limit(self, user_id: int, amount: int) -> bool:
         """Проверка дневного лимита для пользователя"""
         try:
-            # Получаем все выводы пользователя за сегодня
-            today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-            tomorrow = today + timedelta(days=1)
-            
-            user_withdrawals = await self.db_manager.get_user_withdrawal_requests(user_id, limit=1000)
-            
-            # Считаем сумму выводов за сегодня
-            today_total = sum(
-                w.amount_fantics for w in user_withdrawals 
-                if today <= w.created_at < tomorrow and w.status in ['pending', 'completed']
-            )
+            # Сумма выводов за сегодня считается в БД: created_at ставит БД по своим часам
+            today_total = await self.db_manager.get_user_withdrawn_today(user_id)
             
             return (today_total + amount) <= WITHDRAWAL_DAILY_LIMIT
             